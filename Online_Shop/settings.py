@@ -41,12 +41,14 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'mainapp.profiling.profiling_middleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
+    'mainapp.cart.cookie_cart_middleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
 
@@ -54,7 +56,7 @@ ROOT_URLCONF = 'Online_Shop.urls'
 
 TEMPLATES = [
     {
-        'BACKEND': 'django.template.backends.django.DjangoTemplates',
+        'BACKEND': 'mainapp.profiling.ProfilingDjangoTemplates',
         'DIRS': [BASE_DIR / 'templates']
         ,
         'APP_DIRS': True,
@@ -78,9 +80,31 @@ DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
+        # Параллельные записи ждут освобождения блокировки, а не падают сразу с "database is locked"
+        'OPTIONS': {'timeout': 20},
+        # Соединение переиспользуется следующими запросами, в том числе в потоках асинхронных страниц
+        'CONN_MAX_AGE': 60,
+        # Тестовая база в файле: в общей памяти SQLite параллельные запросы сразу получают "table is locked"
+        'TEST': {'NAME': BASE_DIR / 'test_db.sqlite3'},
     }
 }
 
+# Cache
+# https://docs.djangoproject.com/en/3.2/topics/cache/
+# Кеш общий для всех процессов на сервере (воркеры, manage.py import_catalog и другие команды), иначе
+# инвалидация из одного процесса не дошла бы до остальных. При нескольких серверах нужен Redis или Memcached.
+
+CACHES = {
+    'default': {
+        'BACKEND': 'mainapp.profiling.ProfilingFileBasedCache',
+        'LOCATION': BASE_DIR / 'cache',
+        'TIMEOUT': 300,
+        'OPTIONS': {'MAX_ENTRIES': 10000},
+    }
+}
+
+SESSION_ENGINE = 'django.contrib.sessions.backends.cached_db'
+
 # Password validation
 # https://docs.djangoproject.com/en/3.2/ref/settings/#auth-password-validators
 
@@ -120,6 +144,52 @@ STATIC_ROOT = os.path.join(BASE_DIR, 'static')
 
 MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
+# Django отдаёт медиафайлы только при DEBUG. В продакшене их отдаёт веб-сервер; уменьшенные копии
+# адресуются хешем содержимого и не меняются, поэтому кешируются навсегда, например в nginx:
+#     location /media/renditions/ {
+#         alias /path/to/media/renditions/;
+#         add_header Cache-Control "public, max-age=31536000, immutable";
+#     }
+
+# Сколько секунд CDN может отдавать анонимную страницу витрины без перепроверки
+STOREFRONT_CACHE_MAX_AGE = 60
+
+# Сколько секунд процесс доверяет своей отметке изменения каталога, прежде чем перечитать её из базы
+CATALOG_MODIFIED_TIMEOUT = 60
+
+# Асинхронные страницы витрины (mainapp/async_views.py); asgi.py включает их по умолчанию,
+# под WSGI они только добавили бы переключений между потоками
+ASYNC_VIEWS = os.environ.get('ASYNC_VIEWS') == '1'
+
+# Профилирование (mainapp/profiling.py): сколько SQL-запросов допускается на одну страницу, по имени адреса.
+# Превышение пишется предупреждением в лог; с QUERY_BUDGETS_RAISE роняет запрос (включается в тестах).
+# Страницы с ETag учитывают и перечитывание отметки каталога из базы (два запроса на модель товара)
+QUERY_BUDGETS = {
+    'main': 12,
+    'category_detail': 16,
+    'product_detail': 12,
+    'cart': 10,
+    'checkout': 8,
+    'make_order': 22,
+    'api_notebooks': 5,
+    'api_smartphones': 5,
+}
+QUERY_BUDGETS_RAISE = False
+
+# Сколько секунд хранится корзина анонимного посетителя (подписанная cookie, см. mainapp/cart.py)
+CART_COOKIE_AGE = 60 * 60 * 24 * 30
+
+# На сколько минут товар в корзине откладывается из остатка
+STOCK_RESERVATION_MINUTES = 15
+
+# Фоновые задачи (manage.py run_workers): пауза перед первым повтором, дальше она удваивается,
+# и время, после которого задача зависшего воркера выдаётся заново
+TASK_RETRY_DELAY_SECONDS = 10
+TASK_TIMEOUT_SECONDS = 300
+
+# Письма покупателям; в боевом окружении здесь настраивается SMTP
+EMAIL_BACKEND = 'django.core.mail.backends.console.EmailBackend'
+DEFAULT_FROM_EMAIL = 'shop@localhost'
 
 # STATICFILES_DIRS = (
 #     os.path.join(BASE_DIR, 'static_dev')
@@ -1,11 +1,43 @@
-from django.contrib import admin
+from django.contrib import admin, messages
 from django.forms import ModelChoiceField, ModelForm, ValidationError
-from PIL import Image
+from django.http import StreamingHttpResponse
 from django.utils.safestring import mark_safe
 
+from .export import (
+    EXPORT_FORMATS, ORDER_EXPORT_FIELDS, get_product_export_fields, iter_order_rows, iter_product_rows, render_rows
+)
 from .models import *
 
 
+def streaming_export(rows, fields, export_format, filename):
+    # Строки формируются по мере отправки, ответ не собирается в памяти целиком
+    response = StreamingHttpResponse(render_rows(rows, fields, export_format), content_type=EXPORT_FORMATS[export_format])
+    response['Content-Disposition'] = f'attachment; filename="{filename}.{export_format}"'
+    return response
+
+
+@admin.action(description='Выгрузить выбранные товары в CSV')
+def export_products_csv(modeladmin, request, queryset):
+    return streaming_export(iter_product_rows([queryset]), get_product_export_fields([queryset.model]), 'csv',
+                            queryset.model._meta.model_name)
+
+
+@admin.action(description='Выгрузить выбранные товары в JSONL')
+def export_products_jsonl(modeladmin, request, queryset):
+    return streaming_export(iter_product_rows([queryset]), get_product_export_fields([queryset.model]), 'jsonl',
+                            queryset.model._meta.model_name)
+
+
+@admin.action(description='Выгрузить выбранные заказы в CSV')
+def export_orders_csv(modeladmin, request, queryset):
+    return streaming_export(iter_order_rows(queryset), ORDER_EXPORT_FIELDS, 'csv', 'orders')
+
+
+@admin.action(description='Выгрузить выбранные заказы в JSONL')
+def export_orders_jsonl(modeladmin, request, queryset):
+    return streaming_export(iter_order_rows(queryset), ORDER_EXPORT_FIELDS, 'jsonl', 'orders')
+
+
 class SmartphoneAdminForm(ModelForm):
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
@@ -32,7 +64,10 @@ class NotebookAdminForm(ModelForm):
 
     def clean_image(self):
         image = self.cleaned_data['image']
-        img = Image.open(image)
+        # forms.ImageField уже открыл новый файл и сохранил его в image.image, повторно не декодируем
+        img = getattr(image, 'image', None)
+        if img is None:
+            return image
         min_width, min_height = Products.MIN_RESOLUTION
         max_width, max_height = Products.MAX_RESOLUTION
 
@@ -50,6 +85,7 @@ class NotebookAdminForm(ModelForm):
 
 class NotebookAdmin(admin.ModelAdmin):
     form = NotebookAdminForm
+    actions = [export_products_csv, export_products_jsonl]
 
     def formfield_for_foreignkey(self, db_field, request, **kwargs):
         if db_field.name == 'category':
@@ -60,6 +96,7 @@ class NotebookAdmin(admin.ModelAdmin):
 class SmartphoneAdmin(admin.ModelAdmin):
     form = SmartphoneAdminForm
     change_form_template = 'mainapp/admin.html'
+    actions = [export_products_csv, export_products_jsonl]
 
     def formfield_for_foreignkey(self, db_field, request, **kwargs):
         if db_field.name == 'category':
@@ -67,10 +104,47 @@ class SmartphoneAdmin(admin.ModelAdmin):
         return super().formfield_for_foreignkey(db_field, request, **kwargs)
 
 
+class OrdersAdmin(admin.ModelAdmin):
+    actions = [export_orders_csv, export_orders_jsonl]
+
+
+class StockAdmin(admin.ModelAdmin):
+    list_display = ('__str__', 'available', 'reserved')
+
+    def get_readonly_fields(self, request, obj=None):
+        # Резерв меняется только корзинами и заказами, иначе счётчики разойдутся с записями резервов
+        return ('content_type', 'object_id', 'reserved') if obj else ('reserved',)
+
+    def save_model(self, request, obj, form, change):
+        if not change:
+            return super().save_model(request, obj, form, change)
+        # Полный save() записал бы счётчики, прочитанные вместе с формой, и затёр бы резервы и продажи,
+        # сделанные за это время. Пишем только изменение свободного остатка
+        delta = obj.available - form.initial['available']
+        if delta and not Stock.objects.adjust_available(obj.pk, delta):
+            messages.error(request, 'Свободный остаток уже меньше списываемого количества, он не изменён')
+
+
+class StockReservationAdmin(admin.ModelAdmin):
+    list_display = ('cart', 'content_type', 'object_id', 'quantity', 'expires_at')
+    readonly_fields = ('cart', 'content_type', 'object_id', 'quantity', 'expires_at')
+
+
+class TaskAdmin(admin.ModelAdmin):
+    list_display = ('name', 'status', 'attempts', 'run_at', 'worker', 'finished_at')
+    list_filter = ('status', 'name')
+
+
 admin.site.register(Categories)
 admin.site.register(Notebook, NotebookAdmin)
 admin.site.register(Smartphone, SmartphoneAdmin)
 admin.site.register(CartProducts)
 admin.site.register(Cart)
 admin.site.register(Customers)
-admin.site.register(Orders)
+admin.site.register(CatalogProduct)
+
+admin.site.register(Orders, OrdersAdmin)
+admin.site.register(Stock, StockAdmin)
+admin.site.register(StockReservation, StockReservationAdmin)
+admin.site.register(Task, TaskAdmin)
+
@@ -1,9 +1,125 @@
-from rest_framework.generics import ListAPIView
+import hashlib
+
+from django.views.decorators.http import condition
+from rest_framework.exceptions import NotFound
+from rest_framework.response import Response
+from rest_framework.views import APIView
+from rest_framework.generics import ListAPIView, RetrieveAPIView
+from rest_framework.pagination import CursorPagination
 
 from .serializers import *
 from ..models import *
+from ..search import search_products
+from ..utils import PRODUCTS_PER_PAGE, get_catalog_last_modified, get_page_query, get_product_ordering
+
+
+class ProductCursorPagination(CursorPagination):
+    page_size = PRODUCTS_PER_PAGE
+
+    def get_ordering(self, request, queryset, view):
+        sort, ordering = get_product_ordering(request.query_params.get('sort'))
+        return ordering
+
+
+class ConditionalCatalogMixin:
+    """
+    Отвечает 304 на повторный запрос, если товары перечисленных моделей не менялись.
+    Отметка времени изменения хранится в кеше и обновляется сигналами, поэтому проверка не ходит в базу.
+    """
+    catalog_models = ()
+
+    def get_catalog_models(self):
+        return self.catalog_models
+
+    def get_last_modified(self, request, *args, **kwargs):
+        return max(get_catalog_last_modified(model_name) for model_name in self.get_catalog_models())
+
+    def get_etag(self, request, *args, **kwargs):
+        # Ответ зависит от адреса (курсор, fields, sort) и формата, поэтому они входят в ETag
+        last_modified = self.get_last_modified(request)
+        etag_data = f'{last_modified.isoformat()}:{request.get_full_path()}:{request.accepted_media_type}'
+        return hashlib.md5(etag_data.encode()).hexdigest()
+
+    def get(self, request, *args, **kwargs):
+        get = condition(etag_func=self.get_etag, last_modified_func=self.get_last_modified)(super().get)
+        return get(request, *args, **kwargs)
 
 
 class CategoryListApiView(ListAPIView):
     serializer_class = CategorySerializer
     queryset = Categories.objects.all()
+
+
+class CategoryProductsListApiView(ConditionalCatalogMixin, ListAPIView):
+    CATEGORY_SLUG_TO_SERIALIZER = {
+        'notebooks': NotebookSerializer,
+        'smartphones': SmartphoneSerializer
+    }
+    pagination_class = ProductCursorPagination
+
+    def get_serializer_class(self):
+        if self.kwargs['slug'] not in self.CATEGORY_SLUG_TO_SERIALIZER:
+            raise NotFound()
+        return self.CATEGORY_SLUG_TO_SERIALIZER[self.kwargs['slug']]
+
+    def get_catalog_models(self):
+        return [self.get_serializer_class().Meta.model._meta.model_name]
+
+    def get_queryset(self):
+        model = self.get_serializer_class().Meta.model
+        return model.objects.filter(category__slug=self.kwargs['slug']).select_related('category')
+
+
+class NotebookListApiView(ConditionalCatalogMixin, ListAPIView):
+    serializer_class = NotebookSerializer
+    pagination_class = ProductCursorPagination
+    queryset = Notebook.objects.select_related('category')
+    catalog_models = ('notebook',)
+
+
+class NotebookDetailApiView(ConditionalCatalogMixin, RetrieveAPIView):
+    serializer_class = NotebookSerializer
+    queryset = Notebook.objects.select_related('category')
+    lookup_field = 'slug'
+    catalog_models = ('notebook',)
+
+
+class SmartphoneListApiView(ConditionalCatalogMixin, ListAPIView):
+    serializer_class = SmartphoneSerializer
+    pagination_class = ProductCursorPagination
+    queryset = Smartphone.objects.select_related('category')
+    catalog_models = ('smartphone',)
+
+
+class SmartphoneDetailApiView(ConditionalCatalogMixin, RetrieveAPIView):
+    serializer_class = SmartphoneSerializer
+    queryset = Smartphone.objects.select_related('category')
+    lookup_field = 'slug'
+    catalog_models = ('smartphone',)
+
+
+class CatalogProductListApiView(ConditionalCatalogMixin, ListAPIView):
+    serializer_class = CatalogProductSerializer
+    pagination_class = ProductCursorPagination
+    queryset = CatalogProduct.objects.select_related('category')
+
+    def get_catalog_models(self):
+        return [model._meta.model_name for model in get_product_models()]
+
+
+class SearchApiView(APIView):
+
+    def get(self, request, *args, **kwargs):
+        query = request.query_params.get('q', '').strip()
+        try:
+            page = max(int(request.query_params.get('page', 1)), 1)
+        except ValueError:
+            page = 1
+        products, has_next = search_products(query, page)
+        next_url = None
+        if has_next:
+            next_url = request.build_absolute_uri(f'?{get_page_query(request.query_params, page + 1, "page")}')
+        return Response({
+            'next': next_url,
+            'results': CatalogProductSerializer(products, many=True, context={'request': request}).data
+        })
@@ -3,6 +3,19 @@ from rest_framework import serializers
 from ..models import *
 
 
+class SparseFieldsetMixin:
+    """Оставляет в ответе только поля из параметра запроса ?fields=id,title,price."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        request = self.context.get('request')
+        if request is None or not request.query_params.get('fields'):
+            return
+        requested = set(request.query_params['fields'].split(','))
+        for field_name in set(self.fields) - requested:
+            self.fields.pop(field_name)
+
+
 class CategorySerializer(serializers.ModelSerializer):
     name = serializers.CharField(required=True)
     slug = serializers.SlugField()
@@ -10,3 +23,29 @@ class CategorySerializer(serializers.ModelSerializer):
     class Meta:
         model = Categories
         fields = ['id','name', 'slug']
+
+
+class NotebookSerializer(SparseFieldsetMixin, serializers.ModelSerializer):
+    category = CategorySerializer(read_only=True)
+
+    class Meta:
+        model = Notebook
+        fields = '__all__'
+
+
+class SmartphoneSerializer(SparseFieldsetMixin, serializers.ModelSerializer):
+    category = CategorySerializer(read_only=True)
+
+    class Meta:
+        model = Smartphone
+        fields = '__all__'
+
+
+class CatalogProductSerializer(SparseFieldsetMixin, serializers.ModelSerializer):
+    category = CategorySerializer(read_only=True)
+    ct_model = serializers.CharField(source='get_model_name', read_only=True)
+    url = serializers.CharField(source='get_absolute_url', read_only=True)
+
+    class Meta:
+        model = CatalogProduct
+        fields = ['id', 'title', 'slug', 'price', 'image', 'category', 'ct_model', 'object_id', 'url']
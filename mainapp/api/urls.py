@@ -3,5 +3,12 @@ from django.urls import path
 from .api_views import *
 
 urlpatterns = [
-    path('categories/', CategoryListApiView.as_view(), name='categories')
+    path('categories/', CategoryListApiView.as_view(), name='categories'),
+    path('categories/<str:slug>/products/', CategoryProductsListApiView.as_view(), name='category_products'),
+    path('search/', SearchApiView.as_view(), name='api_search'),
+    path('products/', CatalogProductListApiView.as_view(), name='api_products'),
+    path('notebooks/', NotebookListApiView.as_view(), name='api_notebooks'),
+    path('notebooks/<str:slug>/', NotebookDetailApiView.as_view(), name='api_notebook_detail'),
+    path('smartphones/', SmartphoneListApiView.as_view(), name='api_smartphones'),
+    path('smartphones/<str:slug>/', SmartphoneDetailApiView.as_view(), name='api_smartphone_detail')
 ]
@@ -0,0 +1,107 @@
+"""
+Асинхронные варианты страниц витрины на чтение, подключаются под ASGI (settings.ASYNC_VIEWS).
+
+В Django 3.2 нет асинхронного ORM, поэтому каждый запрос к базе или кешу выполняется в потоке из пула,
+а независимые запросы (меню категорий, новинки, счётчик корзины) запускаются одновременно через gather.
+Цикл событий при этом не блокируется и один ASGI-воркер держит намного больше медленных соединений.
+"""
+import asyncio
+from functools import update_wrapper
+
+from asgiref.sync import sync_to_async
+from django.db import close_old_connections
+from django.utils.decorators import classonlymethod
+
+from .models import *
+from .views import BaseView, CategoryDetailView, ProductDetailView
+
+
+def run_in_thread(func, *args, **kwargs):
+    def call():
+        try:
+            return func(*args, **kwargs)
+        finally:
+            # Поток из пула не получает request_finished, поэтому устаревшие и сломанные соединения
+            # закрываем сами; живые остаются в потоке на CONN_MAX_AGE
+            close_old_connections()
+    # thread_sensitive=False: вызовы идут в разных потоках и действительно выполняются параллельно
+    return sync_to_async(call, thread_sensitive=False)()
+
+
+class AsyncPageMixin:
+    """Асинхронный dispatch для представлений с ConditionalPageMixin и CartMixin."""
+
+    @classonlymethod
+    def as_view(cls, **initkwargs):
+        view = super().as_view(**initkwargs)
+
+        # Django 3.2 не умеет async-обработчики в классах: вызывает ли он представление в цикле событий,
+        # решается по самой функции, поэтому оборачиваем её в корутину
+        async def async_view(request, *args, **kwargs):
+            return await view(request, *args, **kwargs)
+
+        return update_wrapper(async_view, view)
+
+    def check_conditional(self, request, *args, **kwargs):
+        # Сообщения могут лежать в сессии, поэтому их проверка идёт в одном потоке с расчётом ETag
+        if not self.is_conditional(request):
+            return None, None, None
+        return self.get_not_modified_response(request, *args, **kwargs)
+
+    async def dispatch(self, request, *args, **kwargs):
+        if request.method.lower() in self.http_method_names:
+            handler = getattr(self, request.method.lower(), self.http_method_not_allowed)
+        else:
+            handler = self.http_method_not_allowed
+        response, etag, last_modified = await run_in_thread(self.check_conditional, request, *args, **kwargs)
+        if response is None:
+            response = await self.call_handler(handler, *args, **kwargs)
+        # Пользователь и корзина к этому моменту уже загружены, заголовки ставятся без перехода в поток
+        return self.finalize_response(response, etag, last_modified)
+
+    async def call_handler(self, handler, *args, **kwargs):
+        if asyncio.iscoroutinefunction(handler):
+            return await handler(self.request, *args, **kwargs)
+        return await run_in_thread(handler, self.request, *args, **kwargs)
+
+    async def get_cart_total_products(self):
+        # Корзина обычно уже загружена при расчёте ETag, тогда поток не нужен
+        if 'cart' in self.__dict__:
+            return self.cart.total_products
+        return await run_in_thread(lambda: self.cart.total_products)
+
+
+class AsyncBaseView(AsyncPageMixin, BaseView):
+
+    async def get(self, request, *args, **kwargs):
+        categories, products, _ = await asyncio.gather(
+            run_in_thread(Categories.objects.get_categories_for_shop),
+            run_in_thread(self.get_products),
+            self.get_cart_total_products()
+        )
+        return await run_in_thread(self.render_page, categories, products)
+
+
+class AsyncProductDetailView(AsyncPageMixin, ProductDetailView):
+
+    async def get(self, request, *args, **kwargs):
+        categories, cart_total_products = await asyncio.gather(
+            run_in_thread(Categories.objects.get_categories_for_shop),
+            self.get_cart_total_products()
+        )
+        content = await run_in_thread(self.get_page_content, categories)
+        return self.get_page_response(content, cart_total_products)
+
+
+class AsyncCategoryDetailView(AsyncPageMixin, CategoryDetailView):
+
+    def render_page(self, request, *args, **kwargs):
+        return super().get(request, *args, **kwargs).render()
+
+    async def get(self, request, *args, **kwargs):
+        # Меню категорий и корзина прогреваются параллельно, страница затем берёт их из кеша и cached_property
+        await asyncio.gather(
+            run_in_thread(Categories.objects.get_categories_for_shop),
+            self.get_cart_total_products()
+        )
+        return await run_in_thread(self.render_page, request, *args, **kwargs)
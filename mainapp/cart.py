@@ -0,0 +1,189 @@
+import asyncio
+from collections import defaultdict
+from decimal import Decimal
+
+from django.conf import settings
+from django.contrib.contenttypes.models import ContentType
+from django.core import signing
+from django.db import models, transaction
+from django.utils.decorators import sync_and_async_middleware
+
+from .models import Cart, CartProducts, Customers, OutOfStockException, Stock, User
+
+CART_ID_SESSION_KEY = 'cart_id'
+
+
+def get_cart_for_user(user):
+    cart = Cart.objects.filter(owner__user=user, in_order=False).first()
+    if cart:
+        return cart
+    with transaction.atomic():
+        # Блокируем строку пользователя, чтобы параллельные запросы не создали вторую корзину. Пустой UPDATE
+        # вместо SELECT ... FOR UPDATE: SQLite не может повысить блокировку чтения до записи и сразу падает
+        User.objects.filter(pk=user.pk).update(last_login=models.F('last_login'))
+        customer = Customers.objects.filter(user=user).first()
+        if not customer:
+            customer = Customers.objects.create(user=user)
+        cart = Cart.objects.filter(owner=customer, in_order=False).first()
+        if not cart:
+            cart = Cart.objects.create(owner=customer)
+    return cart
+
+
+def get_cart_for_request(request):
+    cart_id = request.session.get(CART_ID_SESSION_KEY)
+    if cart_id:
+        cart = Cart.objects.filter(pk=cart_id, owner__user=request.user, in_order=False).first()
+        if cart:
+            return cart
+    cart = get_cart_for_user(request.user)
+    request.session[CART_ID_SESSION_KEY] = cart.id
+    return cart
+
+
+class CookieCart:
+    """
+    Корзина анонимного посетителя. Хранится в подписанной cookie в виде {'<content_type_id>:<object_id>': quantity}
+    и попадает в базу только при входе пользователя (см. persist): изменения корзины не пишут ни в сессию, ни в базу.
+    Cookie обновляет cookie_cart_middleware, если корзина изменилась за время запроса.
+    """
+    COOKIE_NAME = 'cart'
+    COOKIE_SALT = 'mainapp.cart'
+    REQUEST_ATTRIBUTE = '_cookie_cart'
+
+    def __init__(self, lines=None):
+        self.lines = lines or {}
+        self.modified = False
+        self._products = None
+
+    @classmethod
+    def for_request(cls, request):
+        # Один экземпляр на запрос: его меняют представление и сигнал входа, а сохраняет middleware
+        if not hasattr(request, cls.REQUEST_ATTRIBUTE):
+            try:
+                lines = signing.loads(request.COOKIES.get(cls.COOKIE_NAME, ''), salt=cls.COOKIE_SALT,
+                                      max_age=settings.CART_COOKIE_AGE)
+            except signing.BadSignature:
+                lines = {}
+            setattr(request, cls.REQUEST_ATTRIBUTE, cls(lines if isinstance(lines, dict) else {}))
+        return getattr(request, cls.REQUEST_ATTRIBUTE)
+
+    def update_response(self, response):
+        if not self.modified:
+            return
+        if self.lines:
+            response.set_cookie(
+                self.COOKIE_NAME, signing.dumps(self.lines, salt=self.COOKIE_SALT, compress=True),
+                max_age=settings.CART_COOKIE_AGE, secure=settings.SESSION_COOKIE_SECURE, httponly=True,
+                samesite='Lax'
+            )
+        else:
+            response.delete_cookie(self.COOKIE_NAME, samesite='Lax')
+
+    @staticmethod
+    def get_line_key(content_type, product):
+        return f'{content_type.id}:{product.id}'
+
+    def save(self):
+        self.modified = True
+        self._products = None
+
+    @property
+    def total_products(self):
+        return len(self.lines)
+
+    @property
+    def final_price(self):
+        return sum((item.final_price for item in self.get_products()), Decimal(0))
+
+    def get_products(self):
+        if self._products is not None:
+            return self._products
+        ids_by_content_type = defaultdict(list)
+        for line_key in self.lines:
+            content_type_id, object_id = map(int, line_key.split(':'))
+            ids_by_content_type[content_type_id].append(object_id)
+        # Один запрос на каждую модель товара, как и у корзины в базе
+        objects_by_content_type = {
+            content_type_id: ContentType.objects.get_for_id(content_type_id).model_class()._base_manager.in_bulk(ids)
+            for content_type_id, ids in ids_by_content_type.items()
+        }
+        self._products = []
+        for line_key, quantity in list(self.lines.items()):
+            content_type_id, object_id = map(int, line_key.split(':'))
+            product = objects_by_content_type[content_type_id].get(object_id)
+            if product is None:
+                # Товар удалён из каталога, счётчик корзины не должен его учитывать
+                del self.lines[line_key]
+                self.modified = True
+                continue
+            self._products.append(
+                CartProducts(content_object=product, quantity=quantity, final_price=quantity * product.price)
+            )
+        return self._products
+
+    def check_stock(self, content_type, product, quantity):
+        if not Stock.objects.has_available(content_type.id, product.id, quantity):
+            raise OutOfStockException(f'Товара "{product.title}" нет в нужном количестве')
+
+    def add_product(self, content_type, product):
+        line_key = self.get_line_key(content_type, product)
+        if line_key in self.lines:
+            return
+        self.check_stock(content_type, product, 1)
+        self.lines[line_key] = 1
+        self.save()
+
+    def remove_product(self, content_type, product):
+        self.lines.pop(self.get_line_key(content_type, product), None)
+        self.save()
+
+    def change_quantity(self, content_type, product, quantity):
+        line_key = self.get_line_key(content_type, product)
+        if line_key in self.lines:
+            self.check_stock(content_type, product, quantity)
+            self.lines[line_key] = quantity
+            self.save()
+
+    def persist(self, cart):
+        """
+        Переносит позиции в корзину пользователя её же методами, так что товар при этом резервируется.
+        Возвращает товары, которых на складе не хватило: они переносятся в доступном количестве или не переносятся.
+        """
+        missing = []
+        for item in self.get_products():
+            product = item.content_object
+            content_type = ContentType.objects.get_for_id(item.content_type_id)
+            current = CartProducts.objects.filter(
+                cart=cart, content_type=content_type, object_id=product.id
+            ).values_list('quantity', flat=True).first()
+            try:
+                if current is None:
+                    cart.add_product(content_type, product)
+                quantity = (current or 0) + item.quantity
+                if quantity > 1:
+                    cart.change_quantity(content_type, product, quantity)
+            except OutOfStockException:
+                missing.append(product)
+        self.lines = {}
+        self.save()
+        return missing
+
+
+@sync_and_async_middleware
+def cookie_cart_middleware(get_response):
+
+    if asyncio.iscoroutinefunction(get_response):
+        async def middleware(request):
+            response = await get_response(request)
+            if hasattr(request, CookieCart.REQUEST_ATTRIBUTE):
+                CookieCart.for_request(request).update_response(response)
+            return response
+    else:
+        def middleware(request):
+            response = get_response(request)
+            if hasattr(request, CookieCart.REQUEST_ATTRIBUTE):
+                CookieCart.for_request(request).update_response(response)
+            return response
+
+    return middleware
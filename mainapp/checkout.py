@@ -0,0 +1,50 @@
+from django.db import IntegrityError, transaction
+
+from .models import Cart, Orders, OutOfStockException, StockReservation
+from .tasks import enqueue_order_tasks
+
+
+class CheckoutError(Exception):
+    pass
+
+
+def place_order(customer, cart, order, idempotency_key):
+    """
+    Оформляет заказ из корзины и возвращает (заказ, создан ли он сейчас).
+    Повтор с тем же ключом или параллельная отправка по той же корзине возвращают уже созданный заказ.
+    """
+    existing_order = Orders.objects.filter(customer=customer, idempotency_key=idempotency_key).first()
+    if existing_order:
+        return existing_order, False
+    try:
+        with transaction.atomic():
+            # Условный UPDATE захватывает корзину: он блокирует строку как SELECT ... FOR UPDATE,
+            # а в SQLite, где FOR UPDATE нет, сразу берёт блокировку на запись
+            claimed = Cart.objects.filter(
+                pk=cart.pk, owner=customer, in_order=False, total_products__gt=0
+            ).update(in_order=True)
+            if not claimed:
+                existing_order = Orders.objects.filter(customer=customer, cart=cart).first()
+                if existing_order:
+                    return existing_order, False
+                raise CheckoutError('Корзина пуста')
+            try:
+                StockReservation.objects.sell_cart(cart)
+            except OutOfStockException as error:
+                # Исключение откатывает транзакцию, вместе с ней и захват корзины
+                raise CheckoutError(str(error))
+            cart.in_order = True
+            order.customer = customer
+            order.cart = cart
+            order.idempotency_key = idempotency_key
+            order.save(force_insert=True)
+            customer.orders.add(order)
+            # Письмо и смена статуса уходят в очередь и выполняются воркерами уже после фиксации заказа
+            enqueue_order_tasks(order)
+    except IntegrityError:
+        # Параллельный запрос с тем же ключом успел раньше, его транзакция уже зафиксирована
+        existing_order = Orders.objects.filter(customer=customer, idempotency_key=idempotency_key).first()
+        if existing_order is None:
+            raise
+        return existing_order, False
+    return order, True
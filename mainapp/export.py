@@ -0,0 +1,106 @@
+import csv
+import json
+from itertools import islice
+
+from .models import CartProducts, Orders, get_product_models
+
+EXPORT_FORMATS = {
+    'csv': 'text/csv',
+    'jsonl': 'application/x-ndjson',
+}
+EXPORT_CHUNK_SIZE = 2000
+
+ORDER_EXPORT_FIELDS = [
+    'order_id', 'created_at', 'order_at', 'status', 'buying_type', 'first_name', 'last_name', 'phone', 'address',
+    'ct_model', 'slug', 'title', 'quantity', 'final_price'
+]
+
+
+def get_product_fields(model):
+    # Те же столбцы, что читает import_catalog, поэтому выгрузку можно загрузить обратно
+    return [
+        field for field in model._meta.concrete_fields
+        if field.editable and not field.primary_key and field.name != 'category'
+    ]
+
+
+def get_product_export_fields(models=None):
+    fields = ['ct_model', 'category']
+    for model in models or get_product_models():
+        fields.extend(field.name for field in get_product_fields(model) if field.name not in fields)
+    return fields
+
+
+def get_product_row(product):
+    row = {'ct_model': product._meta.model_name, 'category': product.category.slug}
+    for field in get_product_fields(type(product)):
+        value = getattr(product, field.attname)
+        row[field.name] = value.name if field.name == 'image' else value
+    return row
+
+
+def iter_product_rows(querysets=None, chunk_size=EXPORT_CHUNK_SIZE):
+    if querysets is None:
+        querysets = [model._base_manager.all() for model in get_product_models()]
+    for queryset in querysets:
+        for product in queryset.select_related('category').order_by('id').iterator(chunk_size=chunk_size):
+            yield get_product_row(product)
+
+
+def iter_chunks(iterable, chunk_size):
+    iterator = iter(iterable)
+    while True:
+        chunk = list(islice(iterator, chunk_size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def iter_order_rows(orders=None, chunk_size=EXPORT_CHUNK_SIZE):
+    """Строка на каждую позицию заказа. Заказы читаются пачками, товары пачки - одним запросом на модель."""
+    if orders is None:
+        orders = Orders.objects.all()
+    orders = orders.order_by('id').iterator(chunk_size=chunk_size)
+    for chunk in iter_chunks(orders, chunk_size):
+        # iterator() не выполняет prefetch_related, поэтому позиции и товары догружаем на всю пачку сами
+        cart_products = (
+            CartProducts.objects.filter(cart_id__in=[order.cart_id for order in chunk if order.cart_id])
+            .prefetch_related('content_object').order_by('id')
+        )
+        products_by_cart = {}
+        for cart_product in cart_products:
+            products_by_cart.setdefault(cart_product.cart_id, []).append(cart_product)
+        for order in chunk:
+            order_row = {
+                'order_id': order.id, 'created_at': order.created_at, 'order_at': order.order_at,
+                'status': order.status, 'buying_type': order.buying_type, 'first_name': order.first_name,
+                'last_name': order.last_name, 'phone': order.phone, 'address': order.address
+            }
+            for cart_product in products_by_cart.get(order.cart_id, ()):
+                product = cart_product.content_object
+                yield dict(
+                    order_row,
+                    ct_model=product._meta.model_name if product else None,
+                    slug=product.slug if product else None,
+                    title=product.title if product else None,
+                    quantity=cart_product.quantity,
+                    final_price=cart_product.final_price
+                )
+
+
+class Echo:
+    """Файл, который сразу возвращает записанную строку, чтобы csv.writer мог работать внутри генератора."""
+
+    def write(self, value):
+        return value
+
+
+def render_rows(rows, fields, export_format):
+    if export_format == 'csv':
+        writer = csv.DictWriter(Echo(), fields)
+        yield writer.writeheader()
+        for row in rows:
+            yield writer.writerow(row)
+    else:
+        for row in rows:
+            yield json.dumps(row, ensure_ascii=False, default=str) + '\n'
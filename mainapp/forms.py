@@ -9,6 +9,8 @@ class OrderForm(forms.ModelForm):
         self.fields['order_at'].label = 'Дата получения заказа'
 
     order_at = forms.DateField(widget=forms.TextInput(attrs={'type': 'date'}))
+    # Новый ключ выдаётся при каждом показе формы, повторная отправка той же формы приходит с тем же ключом
+    idempotency_key = forms.UUIDField(widget=forms.HiddenInput)
 
     class Meta:
         model = Orders
@@ -0,0 +1,120 @@
+import hashlib
+import json
+from functools import partial
+from io import BytesIO
+
+from PIL import Image, features
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+
+# Ширины уменьшенных копий для srcset, больше исходника копии не делаются
+RENDITION_WIDTHS = (160, 320, 640, 960)
+
+RENDITION_FORMATS = {
+    'jpeg': 'JPEG',
+}
+if features.check('webp'):
+    RENDITION_FORMATS['webp'] = 'WEBP'
+
+RENDITIONS_DIR = 'renditions'
+RENDITION_QUALITY = 85
+RENDITION_MANIFEST = 'manifest.json'
+RENDITION_CACHE_KEY = 'renditions:{image_hash}'
+# Манифест по хешу содержимого не меняется, поэтому готовые манифесты держим ещё и в памяти процесса:
+# карточка товара не читает общий файловый кеш на каждом показе
+RENDITION_MANIFESTS_IN_MEMORY = 10000
+
+_manifests = {}
+
+def get_image_hash(file):
+    sha256 = hashlib.sha256()
+    file.seek(0)
+    for chunk in file.chunks():
+        sha256.update(chunk)
+    file.seek(0)
+    return sha256.hexdigest()
+
+
+def inspect_image_file(path):
+    """
+    Возвращает (размер, ширина, высота, хеш) файла или None, если это не изображение.
+    Не обращается к Django, поэтому может выполняться в отдельном процессе.
+    """
+    sha256 = hashlib.sha256()
+    try:
+        with open(path, 'rb') as file:
+            # Image.open читает только заголовок, изображение не декодируется
+            with Image.open(file) as img:
+                width, height = img.size
+            file.seek(0)
+            for chunk in iter(partial(file.read, 64 * 1024), b''):
+                sha256.update(chunk)
+            return file.tell(), width, height, sha256.hexdigest()
+    except (OSError, SyntaxError, Image.DecompressionBombError):
+        return None
+
+
+def get_rendition_dir(image_hash):
+    # Адрес копии зависит только от содержимого исходника, поэтому файл никогда не меняется
+    return f'{RENDITIONS_DIR}/{image_hash[:2]}/{image_hash}'
+
+
+def get_rendition_name(image_hash, width, extension):
+    return f'{get_rendition_dir(image_hash)}/{width}.{extension}'
+
+
+def get_rendition_manifest(image_hash):
+    manifest = _manifests.get(image_hash)
+    if manifest is not None:
+        return manifest
+    manifest = cache.get(RENDITION_CACHE_KEY.format(image_hash=image_hash))
+    if manifest is None:
+        manifest_name = f'{get_rendition_dir(image_hash)}/{RENDITION_MANIFEST}'
+        if not default_storage.exists(manifest_name):
+            # Отсутствие манифеста не запоминаем: копии могут появиться в любой момент
+            return None
+        with default_storage.open(manifest_name) as manifest_file:
+            manifest = json.load(manifest_file)
+        cache.set(RENDITION_CACHE_KEY.format(image_hash=image_hash), manifest, None)
+    if len(_manifests) >= RENDITION_MANIFESTS_IN_MEMORY:
+        _manifests.clear()
+    _manifests[image_hash] = manifest
+    return manifest
+
+
+def reset_rendition_manifests():
+    _manifests.clear()
+
+
+def generate_renditions(name, image_hash):
+    if get_rendition_manifest(image_hash):
+        # Такое же изображение уже обработано, копии переиспользуются как есть
+        return
+    with default_storage.open(name) as source:
+        img = Image.open(source)
+        # Для JPEG декодируем сразу в уменьшенном масштабе, полный размер не нужен ни одной копии
+        img.draft('RGB', (max(RENDITION_WIDTHS), max(RENDITION_WIDTHS)))
+        img = img.convert('RGB')
+    widths = [width for width in RENDITION_WIDTHS if width <= img.width] or [img.width]
+    for width in widths:
+        resized = img.resize((width, round(img.height * width / img.width)), Image.LANCZOS)
+        for extension, image_format in RENDITION_FORMATS.items():
+            stream = BytesIO()
+            resized.save(stream, image_format, quality=RENDITION_QUALITY)
+            rendition_name = get_rendition_name(image_hash, width, extension)
+            if not default_storage.exists(rendition_name):
+                default_storage.save(rendition_name, ContentFile(stream.getvalue()))
+    # Манифест пишется последним: его наличие означает, что все копии готовы
+    manifest = json.dumps({'widths': widths, 'formats': list(RENDITION_FORMATS)})
+    default_storage.save(f'{get_rendition_dir(image_hash)}/{RENDITION_MANIFEST}', ContentFile(manifest.encode()))
+
+
+def get_rendition_srcset(image_hash, extension='jpeg'):
+    manifest = get_rendition_manifest(image_hash)
+    if not manifest or extension not in manifest['formats']:
+        return ''
+    return ', '.join(
+        f'{default_storage.url(get_rendition_name(image_hash, width, extension))} {width}w'
+        for width in manifest['widths']
+    )
@@ -0,0 +1,31 @@
+from django.core.management.base import BaseCommand
+
+from mainapp.export import (
+    EXPORT_CHUNK_SIZE, EXPORT_FORMATS, ORDER_EXPORT_FIELDS, get_product_export_fields, iter_order_rows,
+    iter_product_rows, render_rows
+)
+
+
+class Command(BaseCommand):
+    help = 'Выгружает товары или заказы в CSV или JSONL, читая базу пачками'
+
+    def add_arguments(self, parser):
+        parser.add_argument('kind', choices=['products', 'orders'])
+        parser.add_argument('--format', choices=list(EXPORT_FORMATS), default='csv')
+        parser.add_argument('--output', help='Файл для выгрузки, по умолчанию стандартный вывод')
+        parser.add_argument('--chunk-size', type=int, default=EXPORT_CHUNK_SIZE,
+                            help='Сколько строк читать из базы за один запрос')
+
+    def handle(self, *args, **options):
+        if options['kind'] == 'products':
+            rows, fields = iter_product_rows(chunk_size=options['chunk_size']), get_product_export_fields()
+        else:
+            rows, fields = iter_order_rows(chunk_size=options['chunk_size']), ORDER_EXPORT_FIELDS
+        lines = render_rows(rows, fields, options['format'])
+        if not options['output']:
+            for line in lines:
+                self.stdout.write(line, ending='')
+            return
+        with open(options['output'], 'w', encoding='utf-8', newline='') as output:
+            output.writelines(lines)
+        self.stdout.write(self.style.SUCCESS(f'Выгрузка сохранена в {options["output"]}'))
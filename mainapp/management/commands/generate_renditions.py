@@ -0,0 +1,29 @@
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand
+
+from mainapp.images import generate_renditions, get_image_hash
+from mainapp.models import CatalogProduct, LatestProducts, get_product_models
+
+
+class Command(BaseCommand):
+    help = 'Считает хеши изображений уже загруженных товаров и готовит для них уменьшенные копии'
+
+    def handle(self, *args, **options):
+        hashes = {}
+        for model in get_product_models():
+            for product in model._base_manager.exclude(image='').only('image', 'image_hash').iterator():
+                if not product.image_hash:
+                    if product.image.name not in hashes:
+                        with default_storage.open(product.image.name) as image:
+                            hashes[product.image.name] = get_image_hash(image)
+                    product.image_hash = hashes[product.image.name]
+                    # update() вместо save(): сигналы и проверка изображения здесь не нужны
+                    model._base_manager.filter(pk=product.pk).update(image_hash=product.image_hash)
+                hashes[product.image.name] = product.image_hash
+        for name, image_hash in hashes.items():
+            CatalogProduct.objects.filter(image=name).update(image_hash=image_hash)
+            generate_renditions(name, image_hash)
+            self.stdout.write(f'{name} -> {image_hash}')
+        for model in get_product_models():
+            LatestProducts.objects.update_cache(model._meta.model_name)
+        self.stdout.write(self.style.SUCCESS(f'Обработано изображений: {len(hashes)}'))
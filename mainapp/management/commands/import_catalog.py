@@ -0,0 +1,201 @@
+import csv
+import json
+import os
+import time
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
+
+from django.core.exceptions import SuspiciousFileOperation, ValidationError
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.utils import timezone
+
+from mainapp import search
+from mainapp.export import get_product_fields
+from mainapp.images import inspect_image_file
+from mainapp.models import (
+    CatalogProduct, Categories, LatestProducts, MaxImageSizeException, MaxResolutionException,
+    MinResolutionException, ProductFacet, get_product_models
+)
+from mainapp.templatetags.specifications import invalidate_product_spec
+from mainapp.utils import get_catalog_db_modified, invalidate_product_page, touch_catalog
+
+
+class RowError(Exception):
+    pass
+
+
+ROW_ERRORS = (RowError, ValidationError, MinResolutionException, MaxResolutionException, MaxImageSizeException)
+
+
+class Command(BaseCommand):
+    help = (
+        'Загружает товары из CSV или JSONL и обновляет уже существующие по slug. '
+        'Столбцы совпадают с полями модели, category - slug категории, image - путь к файлу относительно MEDIA_ROOT'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('files', nargs='+', help='Файлы .csv или .jsonl')
+        parser.add_argument('--model', choices=[model._meta.model_name for model in get_product_models()],
+                            help='Модель товаров, если в файле нет столбца ct_model')
+        parser.add_argument('--batch-size', type=int, default=1000, help='Сколько строк сохранять за один раз')
+        parser.add_argument('--workers', type=int, default=os.cpu_count(),
+                            help='Сколько процессов проверяют изображения')
+
+    def handle(self, *args, **options):
+        self.models = {model._meta.model_name: model for model in get_product_models()}
+        self.default_model = options['model']
+        self.batch_size = options['batch_size']
+        self.categories = Categories.objects.in_bulk(field_name='slug')
+        self.counters = defaultdict(int)
+        self.changed_models = set()
+        started = time.monotonic()
+        with ProcessPoolExecutor(max_workers=options['workers']) as executor:
+            for path in options['files']:
+                rows = self.read_rows(path)
+                # Файл читается пачками, в памяти одновременно только одна пачка строк
+                while True:
+                    batch = list(islice(rows, self.batch_size))
+                    if not batch:
+                        break
+                    self.import_batch(path, batch, executor)
+                    self.write_progress(path, started)
+        # Сигналы при массовом сохранении не срабатывают, поэтому общий для всех процессов кеш обновляем сами
+        Categories.objects.invalidate_cache()
+        for model_name in self.changed_models:
+            LatestProducts.objects.update_cache(model_name)
+            touch_catalog(model_name, get_catalog_db_modified(model_name))
+        self.write_progress('Итого', started, style=self.style.SUCCESS)
+        if self.counters['created'] or self.counters['updated']:
+            self.stdout.write('Уменьшенные копии новых изображений готовит команда generate_renditions')
+
+    def read_rows(self, path):
+        with open(path, encoding='utf-8', newline='') as file:
+            if path.endswith('.jsonl'):
+                for line_number, line in enumerate(file, start=1):
+                    if not line.strip():
+                        continue
+                    try:
+                        yield line_number, json.loads(line)
+                    except ValueError as error:
+                        self.skip_row(path, line_number, error)
+            else:
+                # Первая строка CSV - заголовок
+                for line_number, row in enumerate(csv.DictReader(file), start=2):
+                    yield line_number, row
+
+    def skip_row(self, path, line_number, error):
+        self.counters['skipped'] += 1
+        message = '; '.join(error.messages) if isinstance(error, ValidationError) else error
+        self.stderr.write(f'{path}:{line_number}: {message}')
+
+    def write_progress(self, title, started, style=None):
+        elapsed = time.monotonic() - started
+        rate = self.counters['processed'] / elapsed if elapsed else 0
+        message = (
+            f'{title}: строк {self.counters["processed"]}, создано {self.counters["created"]}, '
+            f'обновлено {self.counters["updated"]}, без изменений {self.counters["unchanged"]}, '
+            f'пропущено {self.counters["skipped"]} ({rate:.0f} строк/с)'
+        )
+        self.stdout.write(style(message) if style else message)
+
+    def get_row_values(self, row):
+        model = self.models.get(row.get('ct_model') or self.default_model)
+        if model is None:
+            raise RowError('Не указана модель товара (столбец ct_model или параметр --model)')
+        values = {}
+        for field in get_product_fields(model):
+            raw_value = row.get(field.name)
+            if raw_value is None or raw_value == '':
+                if field.has_default():
+                    continue
+                if not (field.null or field.blank):
+                    raise RowError(f'Не заполнено поле {field.name}')
+                raw_value = None if field.null else ''
+            values[field.name] = field.to_python(raw_value)
+        category = self.categories.get(row.get('category'))
+        if category is None:
+            raise RowError(f'Неизвестная категория {row.get("category")!r}')
+        values['category_id'] = category.id
+        return model, values
+
+    def import_batch(self, path, batch, executor):
+        rows_by_model = defaultdict(dict)
+        for line_number, row in batch:
+            self.counters['processed'] += 1
+            try:
+                model, values = self.get_row_values(row)
+            except ROW_ERRORS as error:
+                self.skip_row(path, line_number, error)
+                continue
+            # Повтор slug внутри пачки - последняя строка побеждает, как и при повторе в разных пачках
+            rows_by_model[model][values['slug']] = (line_number, values)
+        for model, rows in rows_by_model.items():
+            self.import_products(path, model, rows, executor)
+
+    def get_image_info(self, image_names, executor):
+        # Чтение и хеширование файлов - самая медленная часть, она идёт параллельно в отдельных процессах
+        paths = {}
+        for name in image_names:
+            try:
+                paths[name] = default_storage.path(name)
+            except SuspiciousFileOperation:
+                continue
+        return dict(zip(paths, executor.map(inspect_image_file, paths.values(), chunksize=16)))
+
+    def check_image(self, model, image_info):
+        if image_info is None:
+            raise RowError('Файл изображения не найден или не является изображением')
+        size, width, height, image_hash = image_info
+        model.check_image(size, width, height)
+        return image_hash
+
+    def import_products(self, path, model, rows, executor):
+        existing = model._base_manager.in_bulk(list(rows), field_name='slug')
+        # Уже сохранённое изображение было проверено раньше, проверяются только новые файлы
+        image_info = self.get_image_info({
+            values['image'] for slug, (line_number, values) in rows.items()
+            if slug not in existing or existing[slug].image != values['image']
+        }, executor)
+        now = timezone.now()
+        created, updated = [], []
+        for slug, (line_number, values) in rows.items():
+            product = existing.get(slug)
+            if product is not None and all(getattr(product, field) == value for field, value in values.items()):
+                self.counters['unchanged'] += 1
+                continue
+            try:
+                if product is None or product.image != values['image']:
+                    values['image_hash'] = self.check_image(model, image_info.get(values['image']))
+            except ROW_ERRORS as error:
+                self.skip_row(path, line_number, error)
+                continue
+            if product is None:
+                created.append(model(**values))
+                continue
+            for field, value in values.items():
+                setattr(product, field, value)
+            # bulk_update не вызывает auto_now
+            product.updated_at = now
+            updated.append(product)
+        if not created and not updated:
+            return
+        update_fields = [field.attname for field in get_product_fields(model)] + [
+            'category_id', 'image_hash', 'updated_at'
+        ]
+        with transaction.atomic():
+            model._base_manager.bulk_create(created, batch_size=self.batch_size)
+            model._base_manager.bulk_update(updated, update_fields, batch_size=self.batch_size)
+            # bulk_create проставляет id не во всех СУБД, поэтому пачку перечитываем
+            products = list(model._base_manager.filter(slug__in=[product.slug for product in created + updated]))
+            CatalogProduct.objects.sync_products(model, products)
+            ProductFacet.objects.sync_products(model, products)
+            search.index_products(model, products)
+        for product in updated:
+            invalidate_product_spec(product)
+            invalidate_product_page(model._meta.model_name, product.slug)
+        self.counters['created'] += len(created)
+        self.counters['updated'] += len(updated)
+        self.changed_models.add(model._meta.model_name)
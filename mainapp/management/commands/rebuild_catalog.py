@@ -0,0 +1,12 @@
+from django.core.management.base import BaseCommand
+
+from mainapp.models import CatalogProduct, ProductFacet
+
+
+class Command(BaseCommand):
+    help = 'Перестраивает сводную таблицу каталога и индекс фасетов по всем моделям товаров'
+
+    def handle(self, *args, **options):
+        CatalogProduct.objects.rebuild()
+        ProductFacet.objects.rebuild()
+        self.stdout.write(self.style.SUCCESS(f'Товаров в каталоге: {CatalogProduct.objects.count()}'))
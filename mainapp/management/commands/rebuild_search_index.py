@@ -0,0 +1,10 @@
+from django.core.management.base import BaseCommand
+
+from mainapp.search import rebuild_index
+
+
+class Command(BaseCommand):
+    help = 'Перестраивает полнотекстовый индекс товаров'
+
+    def handle(self, *args, **options):
+        self.stdout.write(self.style.SUCCESS(f'Проиндексировано товаров: {rebuild_index()}'))
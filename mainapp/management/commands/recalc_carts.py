@@ -0,0 +1,35 @@
+from django.core.management.base import BaseCommand
+from django.db import models
+
+from mainapp.models import Cart
+from mainapp.utils import calc_cart
+
+
+class Command(BaseCommand):
+    help = 'Полностью пересчитывает итоги корзин (total_products, final_price) по их позициям'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--check', action='store_true',
+                            help='Только проверить итоги и вывести расхождения, ничего не сохраняя')
+        parser.add_argument('--all', action='store_true', help='Включить корзины, по которым уже оформлен заказ')
+
+    def handle(self, *args, **options):
+        carts = Cart.objects.all() if options['all'] else Cart.objects.filter(in_order=False)
+        carts = carts.annotate(
+            actual_final_price=models.Sum('products__final_price'),
+            actual_total_products=models.Count('products')
+        )
+        mismatched = 0
+        for cart in carts.iterator():
+            actual_final_price = cart.actual_final_price or 0
+            if cart.final_price == actual_final_price and cart.total_products == cart.actual_total_products:
+                continue
+            mismatched += 1
+            self.stdout.write(
+                f'Корзина {cart.id}: {cart.total_products} / {cart.final_price}, '
+                f'по позициям {cart.actual_total_products} / {actual_final_price}'
+            )
+            if not options['check']:
+                calc_cart(cart)
+        action = 'Найдено' if options['check'] else 'Исправлено'
+        self.stdout.write(self.style.SUCCESS(f'{action} корзин с расхождениями: {mismatched}'))
@@ -0,0 +1,22 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from mainapp.models import StockReservation
+
+
+class Command(BaseCommand):
+    help = 'Возвращает в остаток товары из истёкших резервов корзин'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--interval', type=int,
+                            help='Работать постоянно, проверяя резервы раз в указанное число секунд')
+
+    def handle(self, *args, **options):
+        while True:
+            released = StockReservation.objects.release_expired()
+            if released or not options['interval']:
+                self.stdout.write(self.style.SUCCESS(f'Снято истёкших резервов: {released}'))
+            if not options['interval']:
+                return
+            time.sleep(options['interval'])
@@ -0,0 +1,44 @@
+import multiprocessing
+import os
+
+from django.core.management.base import BaseCommand
+from django.db import connections
+
+from mainapp.tasks import work
+
+
+def run_worker(burst, poll_interval):
+    # Соединение родителя нельзя использовать в дочернем процессе, каждый воркер открывает своё
+    connections.close_all()
+    work(burst=burst, poll_interval=poll_interval)
+
+
+class Command(BaseCommand):
+    help = 'Запускает процессы, выполняющие фоновые задачи из очереди'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--processes', type=int, default=os.cpu_count(), help='Сколько процессов запустить')
+        parser.add_argument('--poll-interval', type=float, default=1.0,
+                            help='Пауза в секундах, когда очередь пуста')
+        parser.add_argument('--burst', action='store_true', help='Завершиться, когда очередь опустеет')
+
+    def handle(self, *args, **options):
+        connections.close_all()
+        # fork: дочерние процессы получают уже настроенный Django и зарегистрированные задачи
+        context = multiprocessing.get_context('fork')
+        workers = [
+            context.Process(target=run_worker, args=(options['burst'], options['poll_interval']), daemon=True)
+            for _ in range(options['processes'])
+        ]
+        for worker in workers:
+            worker.start()
+        self.stdout.write(f'Запущено воркеров: {len(workers)}')
+        try:
+            for worker in workers:
+                worker.join()
+        except KeyboardInterrupt:
+            for worker in workers:
+                worker.terminate()
+            for worker in workers:
+                worker.join()
+        self.stdout.write(self.style.SUCCESS('Воркеры остановлены'))
@@ -0,0 +1,25 @@
+from django.db import migrations, models
+
+
+def recalc_cart_totals(apps, schema_editor):
+    Cart = apps.get_model('mainapp', 'Cart')
+    carts = Cart.objects.annotate(
+        actual_final_price=models.Sum('products__final_price'),
+        actual_total_products=models.Count('products')
+    )
+    for cart in carts.iterator():
+        Cart.objects.filter(pk=cart.pk).update(
+            final_price=cart.actual_final_price or 0,
+            total_products=cart.actual_total_products
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mainapp', '0010_orders_cart'),
+    ]
+
+    operations = [
+        migrations.RunPython(recalc_cart_totals, migrations.RunPython.noop),
+    ]
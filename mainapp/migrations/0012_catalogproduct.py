@@ -0,0 +1,58 @@
+# Generated by Django 3.2.5 on 2026-10-16 23:04
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def fill_catalog(apps, schema_editor):
+    ContentType = apps.get_model('contenttypes', 'ContentType')
+    CatalogProduct = apps.get_model('mainapp', 'CatalogProduct')
+    for model_name in ('notebook', 'smartphone'):
+        model = apps.get_model('mainapp', model_name)
+        content_type = ContentType.objects.get_for_model(model)
+        CatalogProduct.objects.bulk_create([
+            CatalogProduct(content_type=content_type, object_id=product.id, title=product.title, slug=product.slug,
+                           price=product.price, image=product.image.name, category_id=product.category_id)
+            for product in model.objects.order_by('id').iterator()
+        ], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('contenttypes', '0002_remove_content_type_name'),
+        ('mainapp', '0011_recalc_cart_totals'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CatalogProduct',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('title', models.CharField(max_length=255, verbose_name='Название товара')),
+                ('slug', models.SlugField()),
+                ('image', models.ImageField(upload_to='', verbose_name='Изображение')),
+                ('price', models.DecimalField(decimal_places=2, max_digits=9, verbose_name='Цена')),
+                ('object_id', models.PositiveIntegerField()),
+                ('category', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='mainapp.categories')),
+                ('content_type', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='contenttypes.contenttype')),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='catalogproduct',
+            index=models.Index(fields=['price'], name='mainapp_cat_price_72ade5_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='catalogproduct',
+            index=models.Index(fields=['title'], name='mainapp_cat_title_c02893_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='catalogproduct',
+            index=models.Index(fields=['category', 'price'], name='mainapp_cat_categor_2b8e01_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='catalogproduct',
+            constraint=models.UniqueConstraint(fields=('content_type', 'object_id'), name='unique_catalog_product'),
+        ),
+        migrations.RunPython(fill_catalog, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,53 @@
+# Generated by Django 3.2.5 on 2026-10-16 23:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mainapp', '0012_catalogproduct'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='catalogproduct',
+            name='mainapp_cat_price_72ade5_idx',
+        ),
+        migrations.RemoveIndex(
+            model_name='catalogproduct',
+            name='mainapp_cat_title_c02893_idx',
+        ),
+        migrations.RemoveIndex(
+            model_name='catalogproduct',
+            name='mainapp_cat_categor_2b8e01_idx',
+        ),
+        migrations.AddIndex(
+            model_name='catalogproduct',
+            index=models.Index(fields=['price', 'id'], name='mainapp_cat_price_4dc525_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='catalogproduct',
+            index=models.Index(fields=['title', 'id'], name='mainapp_cat_title_cac1da_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='catalogproduct',
+            index=models.Index(fields=['category', 'price', 'id'], name='mainapp_cat_categor_a2a122_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='notebook',
+            index=models.Index(fields=['price', 'id'], name='notebook_price_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='notebook',
+            index=models.Index(fields=['title', 'id'], name='notebook_title_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='smartphone',
+            index=models.Index(fields=['price', 'id'], name='smartphone_price_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='smartphone',
+            index=models.Index(fields=['title', 'id'], name='smartphone_title_idx'),
+        ),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 3.2.5 on 2026-10-16 23:09
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mainapp', '0013_product_sort_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='catalogproduct',
+            name='image_hash',
+            field=models.CharField(blank=True, max_length=64),
+        ),
+        migrations.AddField(
+            model_name='notebook',
+            name='image_hash',
+            field=models.CharField(blank=True, editable=False, max_length=64),
+        ),
+        migrations.AddField(
+            model_name='smartphone',
+            name='image_hash',
+            field=models.CharField(blank=True, editable=False, max_length=64),
+        ),
+    ]
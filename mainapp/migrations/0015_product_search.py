@@ -0,0 +1,27 @@
+from django.db import migrations
+
+
+def create_search_table(apps, schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    schema_editor.execute(
+        "CREATE VIRTUAL TABLE IF NOT EXISTS mainapp_product_search USING fts5("
+        "title, description, specs, content_type_id UNINDEXED, object_id UNINDEXED, tokenize='unicode61')"
+    )
+
+
+def drop_search_table(apps, schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    schema_editor.execute('DROP TABLE IF EXISTS mainapp_product_search')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mainapp', '0014_image_hash'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_table, drop_search_table),
+    ]
@@ -0,0 +1,34 @@
+# Generated by Django 3.2.5 on 2026-10-16 23:11
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('contenttypes', '0002_remove_content_type_name'),
+        ('mainapp', '0015_product_search'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProductFacet',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=50)),
+                ('value', models.CharField(max_length=100)),
+                ('object_id', models.PositiveIntegerField()),
+                ('category', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='mainapp.categories')),
+                ('content_type', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='contenttypes.contenttype')),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='productfacet',
+            index=models.Index(fields=['content_type', 'name', 'value', 'object_id'], name='mainapp_pro_content_e4e180_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='productfacet',
+            index=models.Index(fields=['content_type', 'object_id'], name='mainapp_pro_content_42fd65_idx'),
+        ),
+    ]
@@ -0,0 +1,30 @@
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mainapp', '0016_productfacet'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='categories',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True, default=django.utils.timezone.now, verbose_name='Изменена'),
+            preserve_default=False,
+        ),
+        migrations.AddField(
+            model_name='notebook',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True, default=django.utils.timezone.now, verbose_name='Изменён'),
+            preserve_default=False,
+        ),
+        migrations.AddField(
+            model_name='smartphone',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True, default=django.utils.timezone.now, verbose_name='Изменён'),
+            preserve_default=False,
+        ),
+    ]
@@ -0,0 +1,33 @@
+from django.db import migrations, models
+
+
+def detach_duplicate_orders(apps, schema_editor):
+    # Повторные заказы по одной корзине (двойная отправка формы) остаются, но отвязываются от корзины,
+    # иначе ограничение уникальности не создать
+    Orders = apps.get_model('mainapp', 'Orders')
+    duplicated_carts = (
+        Orders.objects.filter(cart__isnull=False).values('cart')
+        .annotate(first_order=models.Min('id'), orders_count=models.Count('id')).filter(orders_count__gt=1)
+    )
+    for duplicate in duplicated_carts:
+        Orders.objects.filter(cart=duplicate['cart']).exclude(id=duplicate['first_order']).update(cart=None)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mainapp', '0017_updated_at'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='orders',
+            name='idempotency_key',
+            field=models.UUIDField(blank=True, editable=False, null=True, unique=True),
+        ),
+        migrations.RunPython(detach_duplicate_orders, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='orders',
+            constraint=models.UniqueConstraint(fields=('cart',), name='unique_order_cart'),
+        ),
+    ]
@@ -0,0 +1,29 @@
+from django.db import migrations
+
+
+def set_search_rowids(apps, schema_editor):
+    # Строки индекса получают rowid, вычисляемый из ключа товара (см. search.get_search_rowid)
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    schema_editor.execute(
+        'CREATE TEMP TABLE product_search_copy AS '
+        'SELECT title, description, specs, content_type_id, object_id FROM mainapp_product_search'
+    )
+    schema_editor.execute('DELETE FROM mainapp_product_search')
+    schema_editor.execute(
+        'INSERT INTO mainapp_product_search (rowid, title, description, specs, content_type_id, object_id) '
+        'SELECT content_type_id << 32 | object_id, title, description, specs, content_type_id, object_id '
+        'FROM product_search_copy'
+    )
+    schema_editor.execute('DROP TABLE product_search_copy')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mainapp', '0020_task'),
+    ]
+
+    operations = [
+        migrations.RunPython(set_search_rowids, migrations.RunPython.noop),
+    ]
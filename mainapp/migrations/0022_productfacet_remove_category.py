@@ -0,0 +1,17 @@
+# Generated by Django 3.2.5 on 2026-10-17 00:06
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mainapp', '0021_search_rowid'),
+    ]
+
+    operations = [
+        migrations.RemoveField(
+            model_name='productfacet',
+            name='category',
+        ),
+    ]
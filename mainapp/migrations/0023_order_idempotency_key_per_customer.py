@@ -0,0 +1,22 @@
+# Generated by Django 3.2.5 on 2026-10-17 00:07
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mainapp', '0022_productfacet_remove_category'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='orders',
+            name='idempotency_key',
+            field=models.UUIDField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddConstraint(
+            model_name='orders',
+            constraint=models.UniqueConstraint(fields=('customer', 'idempotency_key'), name='unique_order_idempotency_key'),
+        ),
+    ]
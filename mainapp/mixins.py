@@ -1,7 +1,18 @@
+import hashlib
+
+from django.conf import settings
+from django.contrib import messages
 from django.views.generic.detail import SingleObjectMixin
 from django.views.generic import View
+from django.utils.cache import get_conditional_response, patch_cache_control, patch_vary_headers
+from django.utils.http import http_date, quote_etag
+from django.utils.functional import cached_property
 
 from .models import *
+from .utils import (
+    KeysetPaginator, get_catalog_last_modified, get_first_page_query, get_page_query, get_product_ordering
+)
+from .cart import CookieCart, get_cart_for_request
 
 
 class CategoryDetailMixin(SingleObjectMixin):
@@ -11,33 +22,87 @@ class CategoryDetailMixin(SingleObjectMixin):
     }
 
     def get_context_data(self, **kwargs):
-        if isinstance(self.get_object(), Categories):
-            model = self.CATEGORY_SLUG_TO_PRODUCT_MODEL[self.get_object().slug]
-            context = super().get_context_data(**kwargs)
-            context['categories'] = Categories.objects.get_categories_for_shop()
-            context['category_products'] = model.objects.all()
-            return context
+        # Объект уже получен в DetailView.get, повторный get_object() стоил бы ещё одного запроса
         context = super().get_context_data(**kwargs)
         context['categories'] = Categories.objects.get_categories_for_shop()
+        if isinstance(self.object, Categories):
+            model = self.CATEGORY_SLUG_TO_PRODUCT_MODEL[self.object.slug]
+            sort, ordering = get_product_ordering(self.request.GET.get('sort'))
+            selected_facets = ProductFacet.objects.get_selected(self.request.GET)
+            products = ProductFacet.objects.filter_products(model.objects.all(), selected_facets)
+            page = KeysetPaginator(products, ordering).get_page(self.request.GET.get('cursor'))
+            context['facets'] = ProductFacet.objects.get_facets(model.objects.all(), selected_facets)
+            context['category_products'] = page.object_list
+            context['page'] = page
+            context['sort'] = sort
+            context['first_page_query'] = get_first_page_query(self.request.GET)
+            if page.has_next:
+                context['next_page_query'] = get_page_query(self.request.GET, page.next_cursor)
         return context
 
 
 class CartMixin(View):
-    def dispatch(self, request, *args, **kwargs):
+
+    @cached_property
+    def cart(self):
+        # Корзина ищется только когда она действительно нужна представлению или шаблону
+        if self.request.user.is_authenticated:
+            return get_cart_for_request(self.request)
+        return CookieCart.for_request(self.request)
+
+
+class ConditionalPageMixin(View):
+    """
+    Отвечает 304 Not Modified, если с прошлого визита не менялись ни товары, ни категории, ни счётчик корзины.
+    Страницы без корзины и сообщений одинаковы для всех анонимных посетителей и разрешены к кешированию на CDN.
+    """
+
+    def get_last_modified(self):
+        # Меню категорий со счётчиками есть на каждой странице, поэтому учитываются все модели товаров
+        return max(get_catalog_last_modified(model._meta.model_name) for model in get_product_models())
+
+    def is_public(self):
+        return not self.request.user.is_authenticated and not self.cart.total_products
+
+    def get_etag(self, request, *args, **kwargs):
+        etag_data = f'{self.get_last_modified().isoformat()}:{request.get_full_path()}:{self.cart.total_products}'
         if request.user.is_authenticated:
-            customer = Customers.objects.filter(user=request.user).first()
-            if not customer:
-                customer = Customers.objects.create(
-                    user=request.user
-                )
-            cart = Cart.objects.filter(owner=customer, in_order=False).first()
-            if not cart:
-                cart = Cart.objects.create(owner=customer)
+            etag_data += f':{request.user.pk}'
+        return hashlib.md5(etag_data.encode()).hexdigest()
+
+    def get_public_last_modified(self, request, *args, **kwargs):
+        # Для личной страницы одной даты мало: счётчик корзины меняется без изменения каталога
+        return self.get_last_modified() if self.is_public() else None
+
+    def is_conditional(self, request):
+        # Сообщение показывается один раз, такую страницу нельзя ни кешировать, ни подтверждать через 304
+        return request.method in ('GET', 'HEAD') and not len(messages.get_messages(request))
 
+    def get_not_modified_response(self, request, *args, **kwargs):
+        """Возвращает (ответ 304 или None, etag, last_modified); etag и дата потом попадают в заголовки ответа."""
+        etag = quote_etag(self.get_etag(request, *args, **kwargs))
+        last_modified = self.get_public_last_modified(request, *args, **kwargs)
+        last_modified = int(last_modified.timestamp()) if last_modified else None
+        return get_conditional_response(request, etag=etag, last_modified=last_modified), etag, last_modified
+
+    def finalize_response(self, response, etag=None, last_modified=None):
+        if etag is None:
+            patch_cache_control(response, private=True, no_cache=True)
+            return response
+        if last_modified and not response.has_header('Last-Modified'):
+            response['Last-Modified'] = http_date(last_modified)
+        response.setdefault('ETag', etag)
+        if self.is_public():
+            patch_cache_control(response, public=True, max_age=0, s_maxage=settings.STOREFRONT_CACHE_MAX_AGE)
         else:
-            cart = Cart.objects.filter(for_anonymous_user=True).first()
-            if not cart:
-                cart = Cart.objects.create(for_anonymous_user=True)
-        self.cart = cart
-        # self.cart.save()
-        return super().dispatch(request, *args, **kwargs)
+            patch_cache_control(response, private=True, max_age=0)
+        patch_vary_headers(response, ('Cookie',))
+        return response
+
+    def dispatch(self, request, *args, **kwargs):
+        if not self.is_conditional(request):
+            return self.finalize_response(super().dispatch(request, *args, **kwargs))
+        response, etag, last_modified = self.get_not_modified_response(request, *args, **kwargs)
+        if response is None:
+            response = super().dispatch(request, *args, **kwargs)
+        return self.finalize_response(response, etag, last_modified)
@@ -1,15 +1,21 @@
-from django.db import models
-from PIL import Image
+import re
+from datetime import timedelta
+
+from django.apps import apps
+from django.conf import settings
+from django.db import models, transaction
+from django.core.cache import cache
 from django.contrib.auth import get_user_model
 from django.contrib.contenttypes.models import ContentType
 from django.contrib.contenttypes.fields import GenericForeignKey
 from django.urls import reverse
-from django.core.files.uploadedfile import InMemoryUploadedFile
-from io import BytesIO
-import sys
+from django.core.files.images import get_image_dimensions
 
 from django.utils import timezone
 
+from .images import get_image_hash
+from .utils import apply_cart_delta, invalidate_product_page, touch_catalog
+
 User = get_user_model()
 
 
@@ -34,21 +40,43 @@ class MaxImageSizeException(Exception):
     pass
 
 
+class InvalidImageException(Exception):
+    pass
+
+
+class OutOfStockException(Exception):
+    pass
+
+
 class LatestProductsManager:
-    @staticmethod
-    def get_products_for_main_page(*args, **kwargs):
+    CACHE_KEY = 'latest_products:{model_name}'
+    PRODUCTS_COUNT = 5
+
+    def get_cache_key(self, model_name):
+        return self.CACHE_KEY.format(model_name=model_name)
+
+    def update_cache(self, model_name):
+        try:
+            model = apps.get_model('mainapp', model_name)
+        except LookupError:
+            return []
+        model_products = list(model._base_manager.order_by('-id')[:self.PRODUCTS_COUNT])
+        cache.set(self.get_cache_key(model_name), model_products)
+        return model_products
+
+    def get_products_for_main_page(self, *args, **kwargs):
         with_respect_to = kwargs.get('with_respect_to')
         products = []
-        ct_models = ContentType.objects.filter(model__in=args)
-        for ct_model in ct_models:
-            model_products = ct_model.model_class()._base_manager.order_by('-id')[:5]
+        # Все ленты читаются из кеша одним обращением, в базу идём только за отсутствующими
+        cached_products = cache.get_many([self.get_cache_key(model_name) for model_name in args])
+        for model_name in args:
+            model_products = cached_products.get(self.get_cache_key(model_name))
+            if model_products is None:
+                model_products = self.update_cache(model_name)
             products.extend(model_products)
-        if with_respect_to:
-            ct_model = ContentType.objects.filter(model=with_respect_to)
-            if ct_model.exists():
-                if with_respect_to in args:
-                    return sorted(products, key=lambda x: x.__class__._meta.model_name.startswith(with_respect_to),
-                                  reverse=True)
+        if with_respect_to and with_respect_to in args:
+            return sorted(products, key=lambda x: x.__class__._meta.model_name.startswith(with_respect_to),
+                          reverse=True)
         return products
 
 
@@ -65,19 +93,28 @@ class CategoryManager(models.Manager):
     def get_queryset(self):
         return super().get_queryset()
 
+    CACHE_KEY = 'categories_for_shop'
+
     def get_categories_for_shop(self):
-        models = get_models_for_count('notebook', 'smartphone')
-        qs = list(self.get_queryset().annotate(*models))
-        data = [
-            dict(name=c.name, url=c.get_absolute_url(), count=getattr(c, self.CATEGORY_NAME_COUNT_NAME[c.name]))
-            for c in qs
-        ]
+        data = cache.get(self.CACHE_KEY)
+        if data is None:
+            models = get_models_for_count('notebook', 'smartphone')
+            qs = list(self.get_queryset().annotate(*models))
+            data = [
+                dict(name=c.name, url=c.get_absolute_url(), count=getattr(c, self.CATEGORY_NAME_COUNT_NAME[c.name]))
+                for c in qs
+            ]
+            cache.set(self.CACHE_KEY, data)
         return data
 
+    def invalidate_cache(self):
+        cache.delete(self.CACHE_KEY)
+
 
 class Categories(models.Model):
     name = models.CharField(max_length=255, verbose_name='Название категории')
     slug = models.SlugField(unique=True)
+    updated_at = models.DateTimeField(auto_now=True, verbose_name='Изменена')
     objects = CategoryManager()
 
     def __str__(self):
@@ -94,14 +131,20 @@ class Products(models.Model):
 
     class Meta:
         abstract = True
+        indexes = [
+            models.Index(fields=['price', 'id'], name='%(class)s_price_idx'),
+            models.Index(fields=['title', 'id'], name='%(class)s_title_idx'),
+        ]
 
     title = models.CharField(max_length=255, verbose_name="Название товара")
     slug = models.SlugField(unique=True)
     image = models.ImageField(verbose_name='Изображение')
+    image_hash = models.CharField(max_length=64, blank=True, editable=False)
     description = models.TextField(verbose_name='Описание товара', null=True)
     price = models.DecimalField(max_digits=9, decimal_places=2, verbose_name='Цена')
 
     category = models.ForeignKey(Categories, on_delete=models.CASCADE)
+    updated_at = models.DateTimeField(auto_now=True, verbose_name='Изменён')
 
     def __str__(self):
         return self.title
@@ -109,42 +152,43 @@ class Products(models.Model):
     def get_model_name(self):
         return self.__class__.__name__.lower()
 
-    def save(self, *args, **kwargs):
-        # Если мы хотим чтобы пользователь сам загружал фото нужного размера
-        image = self.image
-        img = Image.open(image)
-
-        min_width, min_height = self.MIN_RESOLUTION
-        max_width, max_height = self.MAX_RESOLUTION
+    @classmethod
+    def check_image(cls, size, width, height):
+        min_width, min_height = cls.MIN_RESOLUTION
+        max_width, max_height = cls.MAX_RESOLUTION
 
-        if image.size > self.MAX_IMAGE_SIZE:
+        if size > cls.MAX_IMAGE_SIZE:
             raise MaxImageSizeException('Размер изображения больше 3MB')
-        if img.width < min_width or img.height < min_height:
+        if width < min_width or height < min_height:
             raise MinResolutionException('Загруженное изображение меньше допустимого значения')
-        if img.width > max_width or img.height > max_height:
+        if width > max_width or height > max_height:
             raise MaxResolutionException('Загруженное изображение больше допустимого значения')
 
-        # Если мы хотим сами сжимать изображение до нужного размера (Способ 1)
-        # image = self.image
-        # img = Image.open(image)
-        # new_img = img.convert('RGB')
-        # resized_new_img = new_img.resize((200, 200), Image.ANTIALIAS)
-        # filestream = BytesIO()
-        # resized_new_img.save(filestream, 'JPEG', quality=90)
-        # filestream.seek(0)
-        # self.image = InMemoryUploadedFile(filestream, 'ImageField', self.image.name, 'jpeg/image',
-        #                                   sys.getsizeof(filestream), None)
+    def validate_image(self):
+        # Размеры читаются из заголовка файла, само изображение не декодируется
+        width, height = get_image_dimensions(self.image)
+        if width is None:
+            raise InvalidImageException('Загруженный файл не является изображением')
+        self.check_image(self.image.size, width, height)
+
+    def save(self, *args, **kwargs):
+        # Проверяем только новое изображение, уже сохранённое было проверено при загрузке
+        image_uploaded = not self.image._committed
+        if image_uploaded:
+            self.validate_image()
+            self.image_hash = get_image_hash(self.image)
         super().save(*args, **kwargs)
+        if image_uploaded:
+            # Модуль задач сам импортирует модели, поэтому импорт здесь
+            from .tasks import generate_product_renditions
+            generate_product_renditions.delay(self.get_model_name(), self.pk)
 
-        # Пропорциональное сжатие (Способ 2)
-        # image = self.image
-        # img = Image.open(image)
-        # new_img = img.convert('RGB')
-        # w_percent = (self.MAX_RESOLUTION[0] / float(img.size[0]))
-        # h_size = int((float(img.size[1]) * float(w_percent)))
-        # resized_new_img = new_img.resize((self.MAX_RESOLUTION[0], h_size), Image.ANTIALIAS)
-        # self.image = resized_new_img
-        # super().save(*args, **kwargs)
+    def renditions_ready(self):
+        # Закешированная страница товара и ответы 304 ссылаются на исходник, после обработки их нужно обновить
+        invalidate_product_page(self.get_model_name(), self.slug)
+        modified = timezone.now()
+        type(self)._base_manager.filter(pk=self.pk).update(updated_at=modified)
+        touch_catalog(self.get_model_name(), modified)
 
 
 class Notebook(Products):
@@ -181,6 +225,237 @@ class Smartphone(Products):
         return get_url_product(self, 'product_detail')
 
 
+def get_product_models():
+    return [model for model in apps.get_app_config('mainapp').get_models() if issubclass(model, Products)]
+
+
+class CatalogProductManager(models.Manager):
+
+    def get_product_values(self, product):
+        return dict(title=product.title, slug=product.slug, price=product.price, image=product.image.name,
+                    image_hash=product.image_hash, category_id=product.category_id)
+
+    def sync_product(self, product):
+        self.update_or_create(
+            content_type=ContentType.objects.get_for_model(product),
+            object_id=product.id,
+            defaults=self.get_product_values(product)
+        )
+
+    def sync_products(self, model, products):
+        content_type = ContentType.objects.get_for_model(model)
+        existing = {
+            catalog_product.object_id: catalog_product
+            for catalog_product in self.filter(content_type=content_type, object_id__in=[p.id for p in products])
+        }
+        created, updated = [], []
+        for product in products:
+            values = self.get_product_values(product)
+            catalog_product = existing.get(product.id)
+            if catalog_product is None:
+                created.append(self.model(content_type=content_type, object_id=product.id, **values))
+                continue
+            for field, value in values.items():
+                setattr(catalog_product, field, value)
+            updated.append(catalog_product)
+        self.bulk_create(created, batch_size=500)
+        if updated:
+            self.bulk_update(updated, list(values), batch_size=500)
+
+    def remove_product(self, product):
+        self.filter(content_type=ContentType.objects.get_for_model(product), object_id=product.id).delete()
+
+    def rebuild(self):
+        self.all().delete()
+        for model in get_product_models():
+            content_type = ContentType.objects.get_for_model(model)
+            self.bulk_create([
+                self.model(content_type=content_type, object_id=product.id, **self.get_product_values(product))
+                for product in model._base_manager.order_by('id').iterator()
+            ], batch_size=500)
+
+
+class CatalogProduct(models.Model):
+    """Общие поля всех товаров в одной таблице для выборок по всему каталогу."""
+    title = models.CharField(max_length=255, verbose_name="Название товара")
+    slug = models.SlugField()
+    image = models.ImageField(verbose_name='Изображение')
+    image_hash = models.CharField(max_length=64, blank=True)
+    price = models.DecimalField(max_digits=9, decimal_places=2, verbose_name='Цена')
+
+    category = models.ForeignKey(Categories, on_delete=models.CASCADE)
+    content_type = models.ForeignKey(ContentType, on_delete=models.CASCADE)
+    object_id = models.PositiveIntegerField()
+    content_object = GenericForeignKey('content_type', 'object_id')
+    objects = CatalogProductManager()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['content_type', 'object_id'], name='unique_catalog_product')
+        ]
+        indexes = [
+            models.Index(fields=['price', 'id']),
+            models.Index(fields=['title', 'id']),
+            models.Index(fields=['category', 'price', 'id']),
+        ]
+
+    def __str__(self):
+        return self.title
+
+    def get_model_name(self):
+        return ContentType.objects.get_for_id(self.content_type_id).model
+
+    def get_absolute_url(self):
+        return reverse('product_detail', kwargs={'ct_model': self.get_model_name(), 'slug': self.slug})
+
+
+NUMBER_RE = re.compile(r'\d+(?:[.,]\d+)?')
+PRICE_BUCKETS = (0, 10000, 20000, 50000, 100000)
+
+
+def normalize_number(value):
+    match = NUMBER_RE.search(str(value or ''))
+    if not match:
+        return None
+    number = match.group().replace(',', '.')
+    return number.rstrip('0').rstrip('.') if '.' in number else number
+
+
+def normalize_bool(value):
+    return 'yes' if value else 'no'
+
+
+def get_price_bucket(price):
+    for low, high in zip(PRICE_BUCKETS, PRICE_BUCKETS[1:] + (None,)):
+        if high is None or price < high:
+            return f'{low}-{high or ""}'
+
+
+def get_price_bucket_label(bucket):
+    low, _, high = bucket.partition('-')
+    return f'{low} – {high} руб' if high else f'от {low} руб'
+
+
+def get_facet_value_sort_key(value):
+    match = NUMBER_RE.search(value)
+    return (0, float(match.group().replace(',', '.')), value) if match else (1, 0, value)
+
+
+class ProductFacetManager(models.Manager):
+    # Имя фасета -> (подпись, поле товара, нормализация значения, подпись значения)
+    FACETS = {
+        'ram': ('Оперативная память', 'ram', normalize_number, '{} ГБ'.format),
+        'diagonal': ('Диагональ', 'diagonal', normalize_number, '{}"'.format),
+        'sd': ('Поддержка SD карты', 'sd', normalize_bool, {'yes': 'Есть', 'no': 'Нет'}.get),
+        'price': ('Цена', 'price', get_price_bucket, get_price_bucket_label),
+    }
+
+    def get_product_facets(self, product, content_type):
+        facets = []
+        for name, (label, field, normalize, value_label) in self.FACETS.items():
+            if not hasattr(product, field):
+                continue
+            value = normalize(getattr(product, field))
+            if value is not None:
+                facets.append(self.model(content_type=content_type, object_id=product.id, name=name, value=value))
+        return facets
+
+    def sync_product(self, product):
+        self.sync_products(type(product), [product])
+
+    def sync_products(self, model, products):
+        content_type = ContentType.objects.get_for_model(model)
+        self.filter(content_type=content_type, object_id__in=[product.id for product in products]).delete()
+        facets = []
+        for product in products:
+            facets.extend(self.get_product_facets(product, content_type))
+        self.bulk_create(facets, batch_size=500)
+
+    def remove_product(self, product):
+        self.filter(content_type=ContentType.objects.get_for_model(product), object_id=product.id).delete()
+
+    def rebuild(self):
+        self.all().delete()
+        for model in get_product_models():
+            content_type = ContentType.objects.get_for_model(model)
+            facets = []
+            for product in model._base_manager.iterator():
+                facets.extend(self.get_product_facets(product, content_type))
+            self.bulk_create(facets, batch_size=500)
+
+    def get_selected(self, query_dict):
+        return {name: query_dict.getlist(name) for name in self.FACETS if query_dict.getlist(name)}
+
+    def filter_products(self, queryset, selected, exclude=None):
+        # Каждый выбранный фасет - подзапрос к индексу фасетов внутри основного запроса
+        content_type = ContentType.objects.get_for_model(queryset.model)
+        for name, values in selected.items():
+            if name == exclude:
+                continue
+            object_ids = self.filter(content_type=content_type, name=name, value__in=values).values('object_id')
+            queryset = queryset.filter(id__in=object_ids)
+        return queryset
+
+    def get_facets(self, queryset, selected):
+        """Фасеты со счётчиками: для каждого фасета считаются товары с учётом выбора в остальных фасетах."""
+        content_type = ContentType.objects.get_for_model(queryset.model)
+        facets = []
+        for name, (label, field, normalize, value_label) in self.FACETS.items():
+            if not hasattr(queryset.model, field):
+                continue
+            object_ids = self.filter_products(queryset, selected, exclude=name).values('id')
+            counts = (
+                self.filter(content_type=content_type, name=name, object_id__in=object_ids)
+                .values_list('value').annotate(count=models.Count('id')).order_by()
+            )
+            counts = dict(counts)
+            # Выбранное значение показываем даже без товаров, чтобы с него можно было снять отметку
+            for value in selected.get(name, ()):
+                counts.setdefault(value, 0)
+            values = [
+                dict(value=value, label=value_label(value), count=counts[value], selected=value in selected.get(name, ()))
+                for value in sorted(counts, key=get_facet_value_sort_key)
+            ]
+            if values:
+                facets.append(dict(name=name, label=label, values=values))
+        return facets
+
+
+class ProductFacet(models.Model):
+    """Нормализованные значения характеристик для фильтрации и подсчёта товаров по фасетам."""
+    name = models.CharField(max_length=50)
+    value = models.CharField(max_length=100)
+
+    # Страница категории показывает товары одной модели, поэтому фасеты считаются по content_type
+    content_type = models.ForeignKey(ContentType, on_delete=models.CASCADE)
+    object_id = models.PositiveIntegerField()
+    objects = ProductFacetManager()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['content_type', 'name', 'value', 'object_id']),
+            models.Index(fields=['content_type', 'object_id']),
+        ]
+
+    def __str__(self):
+        return f'{self.name}={self.value}'
+
+
+class CartProductsManager(models.Manager):
+
+    def get_products_for_cart(self, cart):
+        # content_object у всех позиций подгружается одним запросом на каждую модель товара
+        return cart.products.prefetch_related('content_object')
+
+    def delete_for_product(self, product):
+        # Удалённый товар убираем из открытых корзин, чтобы их итоги оставались верными
+        content_type = ContentType.objects.get_for_model(product)
+        cart_products = self.filter(content_type=content_type, object_id=product.id, cart__in_order=False)
+        for cart_product in cart_products.select_related('cart'):
+            apply_cart_delta(cart_product.cart, -1, -cart_product.final_price)
+            cart_product.delete()
+
+
 class CartProducts(models.Model):
     quantity = models.PositiveIntegerField(default=1)
     final_price = models.DecimalField(max_digits=9, decimal_places=2, verbose_name='Итоговая цена')
@@ -190,6 +465,7 @@ class CartProducts(models.Model):
     user = models.ForeignKey('Customers', on_delete=models.CASCADE)
     cart = models.ForeignKey('Cart', on_delete=models.CASCADE, related_name='related_products')
     content_type = models.ForeignKey(ContentType, on_delete=models.CASCADE)
+    objects = CartProductsManager()
 
     def __str__(self):
         return f'Продукты: {self.content_object.title} (Для корзины)'
@@ -215,6 +491,57 @@ class Cart(models.Model):
     def __str__(self):
         return str(self.id)
 
+    def get_products(self):
+        return CartProducts.objects.get_products_for_cart(self)
+
+    def lock(self):
+        # Пустой UPDATE блокирует строку корзины до конца транзакции. В SQLite он сразу берёт блокировку
+        # на запись: транзакция, начавшаяся с чтения, не может её повысить и падает с "database is locked"
+        Cart.objects.filter(pk=self.pk).update(total_products=models.F('total_products'))
+
+    @transaction.atomic
+    def add_product(self, content_type, product):
+        self.lock()
+        cart_product, created = CartProducts.objects.get_or_create(
+            user_id=self.owner_id,
+            cart=self,
+            content_type=content_type,
+            object_id=product.id
+        )
+        if created:
+            StockReservation.objects.set_quantity(self, content_type, product, cart_product.quantity)
+            self.products.add(cart_product)
+            apply_cart_delta(self, 1, cart_product.final_price)
+
+    @transaction.atomic
+    def remove_product(self, content_type, product):
+        self.lock()
+        cart_product = CartProducts.objects.select_for_update().get(
+            user_id=self.owner_id,
+            cart=self,
+            content_type=content_type,
+            object_id=product.id
+        )
+        StockReservation.objects.set_quantity(self, content_type, product, 0)
+        self.products.remove(cart_product)
+        cart_product.delete()
+        apply_cart_delta(self, -1, -cart_product.final_price)
+
+    @transaction.atomic
+    def change_quantity(self, content_type, product, quantity):
+        self.lock()
+        cart_product = CartProducts.objects.select_for_update().get(
+            user_id=self.owner_id,
+            cart=self,
+            content_type=content_type,
+            object_id=product.id
+        )
+        StockReservation.objects.set_quantity(self, content_type, product, quantity)
+        old_final_price = cart_product.final_price
+        cart_product.quantity = quantity
+        cart_product.save(update_fields=['quantity', 'final_price'])
+        apply_cart_delta(self, price_delta=cart_product.final_price - old_final_price)
+
 
 class Customers(models.Model):
     phone = models.CharField(max_length=255, null=True, blank=True, verbose_name='Номер телефона')
@@ -263,6 +590,240 @@ class Orders(models.Model):
                                  related_name='related_orders')
     cart = models.ForeignKey(Cart, null=True, blank=True,
                              verbose_name='Корзина', on_delete=models.CASCADE)
+    # Ключ из формы оформления: повторная отправка той же формы не создаёт второй заказ.
+    # Ключ присылает клиент, поэтому он уникален только в пределах покупателя
+    idempotency_key = models.UUIDField(null=True, blank=True, editable=False)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['cart'], name='unique_order_cart'),
+            models.UniqueConstraint(fields=['customer', 'idempotency_key'], name='unique_order_idempotency_key')
+        ]
 
     def __str__(self):
         return str(self.id)
+
+
+class StockManager(models.Manager):
+    """
+    Все изменения остатка - условные UPDATE одной строки товара: покупатели разных товаров не мешают
+    друг другу, а покупатели одного товара держат блокировку строки только на время одного запроса.
+    Товар без записи остатка продаётся без ограничений.
+    """
+
+    def for_product(self, content_type_id, object_id):
+        return self.filter(content_type_id=content_type_id, object_id=object_id)
+
+    def is_limited(self, content_type_id, object_id):
+        return self.for_product(content_type_id, object_id).exists()
+
+    def reserve(self, content_type_id, object_id, quantity):
+        reserved = self.for_product(content_type_id, object_id).filter(available__gte=quantity).update(
+            available=models.F('available') - quantity, reserved=models.F('reserved') + quantity
+        )
+        return bool(reserved) or not self.is_limited(content_type_id, object_id)
+
+    def has_available(self, content_type_id, object_id, quantity):
+        # Проверка без резерва - для корзины анонимного посетителя, её резерв появляется при входе
+        return (self.for_product(content_type_id, object_id).filter(available__gte=quantity).exists()
+                or not self.is_limited(content_type_id, object_id))
+
+    def release(self, content_type_id, object_id, quantity):
+        self.for_product(content_type_id, object_id).update(
+            available=models.F('available') + quantity, reserved=models.F('reserved') - quantity
+        )
+
+    def sell(self, content_type_id, object_id, quantity, reserved=0):
+        """Списывает проданное: сначала из резерва покупателя, недостающее - из свободного остатка."""
+        from_reserve = min(reserved, quantity)
+        if from_reserve:
+            self.for_product(content_type_id, object_id).update(reserved=models.F('reserved') - from_reserve)
+        if reserved > quantity:
+            self.release(content_type_id, object_id, reserved - quantity)
+        missing = quantity - from_reserve
+        if not missing:
+            return True
+        sold = self.for_product(content_type_id, object_id).filter(available__gte=missing).update(
+            available=models.F('available') - missing
+        )
+        return bool(sold) or not self.is_limited(content_type_id, object_id)
+
+    def adjust_available(self, stock_id, delta):
+        # Поступление на склад или списание сдвигает только свободный остаток, резервы корзин не трогаются
+        return bool(self.filter(pk=stock_id, available__gte=-delta).update(available=models.F('available') + delta))
+
+    def remove_product(self, product):
+        content_type = ContentType.objects.get_for_model(product)
+        StockReservation.objects.filter(content_type=content_type, object_id=product.id).delete()
+        self.for_product(content_type.id, product.id).delete()
+
+
+class Stock(models.Model):
+    available = models.PositiveIntegerField(default=0, verbose_name='Свободно')
+    reserved = models.PositiveIntegerField(default=0, verbose_name='В корзинах')
+
+    content_type = models.ForeignKey(ContentType, on_delete=models.CASCADE)
+    object_id = models.PositiveIntegerField()
+    content_object = GenericForeignKey('content_type', 'object_id')
+    objects = StockManager()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['content_type', 'object_id'], name='unique_stock_product')
+        ]
+
+    def __str__(self):
+        return f'{self.content_object}: {self.available} (+{self.reserved} в корзинах)'
+
+
+class StockReservationManager(models.Manager):
+
+    def get_expires_at(self):
+        return timezone.now() + timedelta(minutes=settings.STOCK_RESERVATION_MINUTES)
+
+    def set_quantity(self, cart, content_type, product, quantity):
+        lookup = dict(cart=cart, content_type=content_type, object_id=product.id)
+        expires_at = self.get_expires_at()
+        current = 0
+        # UPDATE продлевает резерв и блокирует его строку, после этого чистка истёкших его уже не снимет
+        if self.filter(**lookup).update(expires_at=expires_at):
+            current = self.filter(**lookup).values_list('quantity', flat=True).get()
+        delta = quantity - current
+        if delta > 0 and not Stock.objects.reserve(content_type.id, product.id, delta):
+            raise OutOfStockException(f'Товара "{product.title}" нет в нужном количестве')
+        if delta < 0:
+            Stock.objects.release(content_type.id, product.id, -delta)
+        if not quantity:
+            self.filter(**lookup).delete()
+        elif current:
+            self.filter(**lookup).update(quantity=quantity)
+        else:
+            self.create(quantity=quantity, expires_at=expires_at, **lookup)
+
+    def sell_cart(self, cart):
+        reservations = {
+            (reservation.content_type_id, reservation.object_id): reservation
+            for reservation in self.filter(cart=cart)
+        }
+        cart_products = CartProducts.objects.filter(cart=cart).prefetch_related('content_object')
+        # Строки остатков блокируются всегда в одном порядке, чтобы встречные заказы не ждали друг друга по кругу
+        for cart_product in sorted(cart_products, key=lambda item: (item.content_type_id, item.object_id)):
+            key = (cart_product.content_type_id, cart_product.object_id)
+            reservation = reservations.pop(key, None)
+            reserved = 0
+            # Резерв достаётся тому, кто удалил его строку: заказу или чистке истёкших резервов
+            if reservation and self.filter(pk=reservation.pk).delete()[0]:
+                reserved = reservation.quantity
+            if not Stock.objects.sell(*key, cart_product.quantity, reserved):
+                raise OutOfStockException(f'Товара "{cart_product.content_object.title}" нет в нужном количестве')
+        for reservation in reservations.values():
+            if self.filter(pk=reservation.pk).delete()[0]:
+                Stock.objects.release(reservation.content_type_id, reservation.object_id, reservation.quantity)
+
+    def release_expired(self, batch_size=500):
+        released = 0
+        now = timezone.now()
+        while True:
+            expired = list(self.filter(expires_at__lt=now).order_by('expires_at')[:batch_size])
+            for reservation in expired:
+                with transaction.atomic():
+                    if self.filter(pk=reservation.pk, expires_at__lt=now).delete()[0]:
+                        Stock.objects.release(reservation.content_type_id, reservation.object_id,
+                                              reservation.quantity)
+                        released += 1
+            if len(expired) < batch_size:
+                return released
+
+
+class StockReservation(models.Model):
+    """Товар в корзине, отложенный из остатка до expires_at."""
+    quantity = models.PositiveIntegerField()
+    expires_at = models.DateTimeField(db_index=True)
+
+    cart = models.ForeignKey(Cart, on_delete=models.CASCADE, related_name='reservations')
+    content_type = models.ForeignKey(ContentType, on_delete=models.CASCADE)
+    object_id = models.PositiveIntegerField()
+    objects = StockReservationManager()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['cart', 'content_type', 'object_id'], name='unique_stock_reservation')
+        ]
+
+    def __str__(self):
+        return f'Корзина {self.cart_id}: {self.quantity} до {self.expires_at}'
+
+
+class TaskManager(models.Manager):
+
+    def get_claimable(self, now):
+        # Задача "в работе" дольше таймаута осталась от упавшего воркера и выдаётся заново
+        stale_started_at = now - timedelta(seconds=settings.TASK_TIMEOUT_SECONDS)
+        return self.filter(
+            models.Q(status=Task.STATUS_PENDING, run_at__lte=now) |
+            models.Q(status=Task.STATUS_RUNNING, started_at__lt=stale_started_at)
+        )
+
+    def claim(self, worker_id):
+        while True:
+            now = timezone.now()
+            task_id = self.get_claimable(now).order_by('run_at', 'id').values_list('id', flat=True).first()
+            if task_id is None:
+                return None
+            # Условный UPDATE: задачу получает только тот воркер, чей запрос её изменил, остальные берут следующую
+            claimed = self.get_claimable(now).filter(pk=task_id).update(
+                status=Task.STATUS_RUNNING, worker=worker_id, started_at=now, attempts=models.F('attempts') + 1
+            )
+            if claimed:
+                return self.get(pk=task_id)
+
+    def finish(self, task):
+        self.filter(pk=task.pk, worker=task.worker).update(status=Task.STATUS_DONE, finished_at=timezone.now())
+
+    def retry_or_fail(self, task, error):
+        if task.attempts >= task.max_attempts:
+            self.filter(pk=task.pk, worker=task.worker).update(
+                status=Task.STATUS_FAILED, finished_at=timezone.now(), last_error=error
+            )
+            return
+        # Экспоненциальная пауза между попытками, не больше часа
+        delay = min(settings.TASK_RETRY_DELAY_SECONDS * 2 ** (task.attempts - 1), 3600)
+        self.filter(pk=task.pk, worker=task.worker).update(
+            status=Task.STATUS_PENDING, run_at=timezone.now() + timedelta(seconds=delay), last_error=error
+        )
+
+
+class Task(models.Model):
+    STATUS_PENDING = 'pending'
+    STATUS_RUNNING = 'running'
+    STATUS_DONE = 'done'
+    STATUS_FAILED = 'failed'
+
+    STATUS_CHOICES = (
+        (STATUS_PENDING, 'Ожидает'),
+        (STATUS_RUNNING, 'Выполняется'),
+        (STATUS_DONE, 'Выполнена'),
+        (STATUS_FAILED, 'Не удалась')
+    )
+
+    name = models.CharField(max_length=255, verbose_name='Задача')
+    args = models.JSONField(default=list)
+    kwargs = models.JSONField(default=dict)
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default=STATUS_PENDING, verbose_name='Статус')
+    attempts = models.PositiveIntegerField(default=0, verbose_name='Попыток')
+    max_attempts = models.PositiveIntegerField(default=5)
+    run_at = models.DateTimeField(default=timezone.now, verbose_name='Выполнить после')
+    worker = models.CharField(max_length=255, blank=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+    last_error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    objects = TaskManager()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'run_at']),
+        ]
+
+    def __str__(self):
+        return f'{self.name} ({self.get_status_display()})'
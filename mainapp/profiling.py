@@ -0,0 +1,206 @@
+"""
+Профилирование запросов: число и время SQL-запросов, время отрисовки шаблонов и попадания в кеш
+по имени адреса (main, cart, product_detail и т.д.).
+
+Текущий запрос хранится в contextvar, поэтому учитываются и запросы из потоков sync_to_async.
+Статистика копится в памяти процесса и отдаётся на /metrics/ в текстовом формате Prometheus;
+при нескольких воркерах у каждого процесса своя статистика, Prometheus суммирует их сам.
+"""
+import asyncio
+import logging
+import threading
+import time
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.core.cache.backends.filebased import FileBasedCache
+from django.core.cache.backends.locmem import LocMemCache
+from django.template.backends.django import DjangoTemplates, Template, reraise
+from django.template import TemplateDoesNotExist
+from django.utils.decorators import sync_and_async_middleware
+
+logger = logging.getLogger(__name__)
+
+UNRESOLVED_VIEW_NAME = '<unresolved>'
+
+# (имя метрики, поле RequestProfile, тип, описание)
+METRICS = (
+    ('shop_requests_total', 'requests', 'counter', 'Обработано запросов'),
+    ('shop_request_seconds_total', 'duration', 'counter', 'Суммарное время обработки запросов'),
+    ('shop_db_queries_total', 'queries', 'counter', 'Выполнено SQL-запросов'),
+    ('shop_db_query_seconds_total', 'query_time', 'counter', 'Суммарное время SQL-запросов'),
+    ('shop_template_render_seconds_total', 'render_time', 'counter', 'Суммарное время отрисовки шаблонов'),
+    ('shop_cache_hits_total', 'cache_hits', 'counter', 'Попадания в кеш'),
+    ('shop_cache_misses_total', 'cache_misses', 'counter', 'Промахи кеша'),
+    ('shop_db_queries_max', 'max_queries', 'gauge', 'Наибольшее число SQL-запросов за один запрос'),
+    ('shop_query_budget_exceeded_total', 'budget_exceeded', 'counter', 'Запросы сверх бюджета QUERY_BUDGETS'),
+)
+
+_current_profile = ContextVar('request_profile', default=None)
+_stats = {}
+_stats_lock = threading.Lock()
+
+
+class QueryBudgetExceeded(Exception):
+    pass
+
+
+class RequestProfile:
+    FIELDS = ('queries', 'query_time', 'render_time', 'cache_hits', 'cache_misses')
+
+    def __init__(self):
+        # Асинхронные представления выполняют запросы к базе сразу в нескольких потоках
+        self.lock = threading.Lock()
+        for field in self.FIELDS:
+            setattr(self, field, 0)
+
+    def add(self, field, value=1):
+        with self.lock:
+            setattr(self, field, getattr(self, field) + value)
+
+
+def record_query(execute, sql, params, many, context):
+    profile = _current_profile.get()
+    if profile is None:
+        return execute(sql, params, many, context)
+    start = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        profile.add('query_time', time.perf_counter() - start)
+        profile.add('queries')
+
+
+def install_query_recorder(sender, connection, **kwargs):
+    # Обёртка ставится на каждое соединение, включая соединения потоков из пула sync_to_async
+    if record_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(record_query)
+
+
+class ProfiledTemplate(Template):
+
+    def render(self, context=None, request=None):
+        profile = _current_profile.get()
+        if profile is None:
+            return super().render(context, request)
+        start = time.perf_counter()
+        try:
+            return super().render(context, request)
+        finally:
+            profile.add('render_time', time.perf_counter() - start)
+
+
+class ProfilingDjangoTemplates(DjangoTemplates):
+    """Шаблонизатор Django, замеряющий отрисовку шаблонов верхнего уровня (include входят в их время)."""
+
+    def from_string(self, template_code):
+        return ProfiledTemplate(self.engine.from_string(template_code), self)
+
+    def get_template(self, template_name):
+        try:
+            return ProfiledTemplate(self.engine.get_template(template_name), self)
+        except TemplateDoesNotExist as exc:
+            reraise(exc, self)
+
+
+class CacheProfilingMixin:
+    # get_many у встроенных бэкендов сводится к get, поэтому отдельно его не считаем
+    _missing = object()
+
+    def record_lookup(self, hits, misses):
+        profile = _current_profile.get()
+        if profile is not None:
+            profile.add('cache_hits', hits)
+            profile.add('cache_misses', misses)
+
+    def get(self, key, default=None, version=None):
+        value = super().get(key, self._missing, version)
+        self.record_lookup(value is not self._missing, value is self._missing)
+        return default if value is self._missing else value
+
+
+class ProfilingLocMemCache(CacheProfilingMixin, LocMemCache):
+    pass
+
+
+class ProfilingFileBasedCache(CacheProfilingMixin, FileBasedCache):
+    pass
+
+
+def get_view_name(request):
+    match = getattr(request, 'resolver_match', None)
+    return match.view_name if match else UNRESOLVED_VIEW_NAME
+
+
+def record_request(request, profile, duration):
+    view_name = get_view_name(request)
+    budget = settings.QUERY_BUDGETS.get(view_name)
+    exceeded = budget is not None and profile.queries > budget
+    with _stats_lock:
+        stats = _stats.setdefault(view_name, dict.fromkeys((field for _, field, _, _ in METRICS), 0))
+        stats['requests'] += 1
+        stats['duration'] += duration
+        for field in RequestProfile.FIELDS:
+            stats[field] += getattr(profile, field)
+        stats['max_queries'] = max(stats['max_queries'], profile.queries)
+        stats['budget_exceeded'] += exceeded
+    if exceeded:
+        message = f'{view_name}: {profile.queries} SQL-запросов при бюджете {budget} ({request.get_full_path()})'
+        if settings.QUERY_BUDGETS_RAISE:
+            raise QueryBudgetExceeded(message)
+        logger.warning(message)
+
+
+def get_stats():
+    with _stats_lock:
+        return {view_name: dict(stats) for view_name, stats in _stats.items()}
+
+
+def reset_stats():
+    with _stats_lock:
+        _stats.clear()
+
+
+def escape_label(value):
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def render_metrics():
+    stats = get_stats()
+    lines = []
+    for metric, field, metric_type, description in METRICS:
+        lines.append(f'# HELP {metric} {description}')
+        lines.append(f'# TYPE {metric} {metric_type}')
+        for view_name, view_stats in sorted(stats.items()):
+            lines.append(f'{metric}{{view="{escape_label(view_name)}"}} {view_stats[field]}')
+    return '\n'.join(lines) + '\n'
+
+
+@sync_and_async_middleware
+def profiling_middleware(get_response):
+    # Ставится первым в MIDDLEWARE, чтобы учитывать запросы сессий и авторизации
+
+    if asyncio.iscoroutinefunction(get_response):
+        async def middleware(request):
+            profile = RequestProfile()
+            token = _current_profile.set(profile)
+            start = time.perf_counter()
+            try:
+                response = await get_response(request)
+                record_request(request, profile, time.perf_counter() - start)
+            finally:
+                _current_profile.reset(token)
+            return response
+    else:
+        def middleware(request):
+            profile = RequestProfile()
+            token = _current_profile.set(profile)
+            start = time.perf_counter()
+            try:
+                response = get_response(request)
+                record_request(request, profile, time.perf_counter() - start)
+            finally:
+                _current_profile.reset(token)
+            return response
+
+    return middleware
@@ -0,0 +1,123 @@
+import re
+
+from django.contrib.contenttypes.models import ContentType
+from django.db import connection, models
+
+from .models import CatalogProduct, get_product_models
+from .templatetags.specifications import PRODUCT_SPEC
+
+SEARCH_TABLE = 'mainapp_product_search'
+# Веса столбцов для bm25: совпадение в названии важнее, чем в описании
+SEARCH_WEIGHTS = (10.0, 1.0, 3.0)
+SEARCH_PER_PAGE = 24
+
+TOKEN_RE = re.compile(r'\w+', re.UNICODE)
+
+
+def is_search_index_available():
+    # Инвертированный индекс - виртуальная таблица FTS5, она есть только в SQLite
+    return connection.vendor == 'sqlite'
+
+
+def get_spec_text(product):
+    spec = PRODUCT_SPEC.get(product._meta.model_name, ())
+    return ' '.join(str(getattr(product, field) or '') for name, field in spec)
+
+
+def get_search_rowid(content_type_id, object_id):
+    # rowid выводится из ключа товара: удаление и переиндексация идут по первичному ключу FTS5,
+    # а не перебором всей таблицы по неиндексируемым столбцам content_type_id/object_id
+    return content_type_id << 32 | object_id
+
+
+def get_index_row(product, content_type):
+    return (get_search_rowid(content_type.id, product.id), product.title, product.description or '',
+            get_spec_text(product), content_type.id, product.id)
+
+
+def delete_rows(cursor, rowids):
+    placeholders = ', '.join(['%s'] * len(rowids))
+    cursor.execute(f'DELETE FROM {SEARCH_TABLE} WHERE rowid IN ({placeholders})', rowids)
+
+
+def index_product(product):
+    index_products(type(product), [product])
+
+
+def index_products(model, products):
+    if not is_search_index_available() or not products:
+        return
+    content_type = ContentType.objects.get_for_model(model)
+    with connection.cursor() as cursor:
+        delete_rows(cursor, [get_search_rowid(content_type.id, product.id) for product in products])
+        insert_rows(cursor, [get_index_row(product, content_type) for product in products])
+
+
+def remove_product(product):
+    if not is_search_index_available():
+        return
+    with connection.cursor() as cursor:
+        delete_rows(cursor, [get_search_rowid(ContentType.objects.get_for_model(product).id, product.id)])
+
+
+def rebuild_index(batch_size=500):
+    if not is_search_index_available():
+        return 0
+    indexed = 0
+    with connection.cursor() as cursor:
+        cursor.execute(f'DELETE FROM {SEARCH_TABLE}')
+        for model in get_product_models():
+            content_type = ContentType.objects.get_for_model(model)
+            rows = []
+            for product in model._base_manager.iterator(chunk_size=batch_size):
+                rows.append(get_index_row(product, content_type))
+                if len(rows) >= batch_size:
+                    indexed += insert_rows(cursor, rows)
+                    rows = []
+            indexed += insert_rows(cursor, rows)
+    return indexed
+
+
+def insert_rows(cursor, rows):
+    cursor.executemany(
+        f'INSERT INTO {SEARCH_TABLE} (rowid, title, description, specs, content_type_id, object_id) '
+        f'VALUES (%s, %s, %s, %s, %s, %s)', rows
+    )
+    return len(rows)
+
+
+def build_match_query(query):
+    # Каждое слово ищется по префиксу, кавычки не дают пользовательскому вводу стать синтаксисом FTS5
+    tokens = TOKEN_RE.findall(query.lower())
+    return ' '.join(f'"{token}"*' for token in tokens)
+
+
+def search_products(query, page=1, per_page=SEARCH_PER_PAGE):
+    """Возвращает (товары каталога в порядке релевантности, есть ли следующая страница)."""
+    match_query = build_match_query(query)
+    if not match_query:
+        return [], False
+    offset = (page - 1) * per_page
+    if not is_search_index_available():
+        products = CatalogProduct.objects.filter(title__icontains=query).select_related('category').order_by('-id')
+        products = list(products[offset:offset + per_page + 1])
+        return products[:per_page], len(products) > per_page
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f'SELECT content_type_id, object_id FROM {SEARCH_TABLE} WHERE {SEARCH_TABLE} MATCH %s '
+            f'ORDER BY bm25({SEARCH_TABLE}, %s, %s, %s) LIMIT %s OFFSET %s',
+            [match_query, *SEARCH_WEIGHTS, per_page + 1, offset]
+        )
+        keys = [(content_type_id, object_id) for content_type_id, object_id in cursor.fetchall()]
+    has_next = len(keys) > per_page
+    keys = keys[:per_page]
+    if not keys:
+        return [], False
+    key_filter = models.Q()
+    for content_type_id, object_id in keys:
+        key_filter |= models.Q(content_type_id=content_type_id, object_id=object_id)
+    products = {
+        (product.content_type_id, product.object_id): product
+        for product in CatalogProduct.objects.filter(key_filter).select_related('category')
+    }
+    return [products[key] for key in keys if key in products], has_next
@@ -0,0 +1,79 @@
+from django.contrib import messages
+from django.contrib.auth.signals import user_logged_in
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch import receiver
+from django.utils import timezone
+
+from . import search
+from .cart import CookieCart, get_cart_for_user
+from .models import (
+    CartProducts, CatalogProduct, Categories, LatestProducts, Notebook, ProductFacet, Smartphone, Stock,
+    get_product_models
+)
+from .templatetags.specifications import invalidate_product_spec
+from .utils import invalidate_product_page, touch_catalog
+
+
+@receiver(post_save, sender=Notebook)
+@receiver(post_save, sender=Smartphone)
+@receiver(post_delete, sender=Notebook)
+@receiver(post_delete, sender=Smartphone)
+def product_changed(sender, instance, signal, **kwargs):
+    Categories.objects.invalidate_cache()
+    LatestProducts.objects.update_cache(sender._meta.model_name)
+    invalidate_product_spec(instance)
+    invalidate_product_page(sender._meta.model_name, instance.slug)
+    if signal is post_save:
+        touch_catalog(sender._meta.model_name, instance.updated_at)
+    else:
+        # У удалённого товара отметки времени нет, её получает категория: так удаление видно и по базе
+        modified = timezone.now()
+        Categories.objects.filter(pk=instance.category_id).update(updated_at=modified)
+        touch_catalog(sender._meta.model_name, modified)
+
+
+@receiver(pre_save, sender=Notebook)
+@receiver(pre_save, sender=Smartphone)
+def product_slug_changed(sender, instance, **kwargs):
+    if instance.pk is None:
+        return
+    old_slug = sender._base_manager.filter(pk=instance.pk).values_list('slug', flat=True).first()
+    if old_slug and old_slug != instance.slug:
+        invalidate_product_page(sender._meta.model_name, old_slug)
+
+
+@receiver(post_save, sender=Notebook)
+@receiver(post_save, sender=Smartphone)
+def product_saved(sender, instance, **kwargs):
+    CatalogProduct.objects.sync_product(instance)
+    ProductFacet.objects.sync_product(instance)
+    search.index_product(instance)
+
+
+@receiver(post_delete, sender=Notebook)
+@receiver(post_delete, sender=Smartphone)
+def product_deleted(sender, instance, **kwargs):
+    CartProducts.objects.delete_for_product(instance)
+    Stock.objects.remove_product(instance)
+    CatalogProduct.objects.remove_product(instance)
+    ProductFacet.objects.remove_product(instance)
+    search.remove_product(instance)
+
+
+@receiver(post_save, sender=Categories)
+@receiver(post_delete, sender=Categories)
+def category_changed(sender, instance, signal, **kwargs):
+    Categories.objects.invalidate_cache()
+    # Категория выводится на всех страницах и вложена в ответы API по товарам
+    modified = instance.updated_at if signal is post_save else None
+    for model in get_product_models():
+        touch_catalog(model._meta.model_name, modified)
+
+
+@receiver(user_logged_in)
+def move_cookie_cart_to_user(sender, request, user, **kwargs):
+    cookie_cart = CookieCart.for_request(request)
+    if cookie_cart.total_products:
+        for product in cookie_cart.persist(get_cart_for_user(user)):
+            messages.add_message(request, messages.INFO, f'Товара "{product.title}" не хватило на складе, '
+                                                         f'в корзине оставлено доступное количество', fail_silently=True)
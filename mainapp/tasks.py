@@ -0,0 +1,111 @@
+import logging
+import os
+import socket
+import time
+import traceback
+
+from django.apps import apps
+from django.core.mail import send_mail
+from django.db import close_old_connections, transaction
+
+from .images import generate_renditions
+from .models import Orders, Task
+
+logger = logging.getLogger(__name__)
+
+TASKS = {}
+
+
+def task(max_attempts=5):
+    """
+    Регистрирует функцию как фоновую задачу. func.delay(*args, **kwargs) ставит её в очередь
+    после фиксации текущей транзакции, аргументы должны сериализоваться в JSON.
+    """
+    def decorator(func):
+        name = f'{func.__module__}.{func.__name__}'
+        TASKS[name] = func
+
+        def delay(*args, **kwargs):
+            transaction.on_commit(lambda: Task.objects.create(
+                name=name, args=list(args), kwargs=kwargs, max_attempts=max_attempts
+            ))
+
+        func.delay = delay
+        return func
+    return decorator
+
+
+def get_worker_id():
+    return f'{socket.gethostname()}:{os.getpid()}'
+
+
+def run_next_task(worker_id):
+    """Выполняет одну задачу из очереди. False - если выполнять нечего."""
+    task_record = Task.objects.claim(worker_id)
+    if task_record is None:
+        return False
+    func = TASKS.get(task_record.name)
+    try:
+        if func is None:
+            raise LookupError(f'Задача {task_record.name} не зарегистрирована')
+        func(*task_record.args, **task_record.kwargs)
+    except Exception:
+        logger.exception('Задача %s (%s) завершилась ошибкой', task_record.name, task_record.id)
+        Task.objects.retry_or_fail(task_record, traceback.format_exc())
+    else:
+        Task.objects.finish(task_record)
+    return True
+
+
+def work(burst=False, poll_interval=1.0):
+    worker_id = get_worker_id()
+    while True:
+        close_old_connections()
+        if run_next_task(worker_id):
+            continue
+        if burst:
+            return
+        time.sleep(poll_interval)
+
+
+@task()
+def send_order_confirmation(order_id):
+    order = Orders.objects.select_related('customer__user').get(pk=order_id)
+    email = order.customer.user.email
+    if not email:
+        return
+    send_mail(
+        f'Заказ №{order.id} принят',
+        f'{order.first_name}, спасибо за заказ! Дата получения: {order.order_at:%d.%m.%Y}.',
+        None,
+        [email]
+    )
+
+
+@task()
+def start_order_processing(order_id):
+    # Условный UPDATE: повтор задачи не откатит заказ, который уже ушёл дальше по статусам
+    Orders.objects.filter(pk=order_id, status=Orders.STATUS_NEW).update(status=Orders.STATUS_IN_PROGRESS)
+
+
+@task()
+def record_order_analytics(order_id):
+    order = Orders.objects.select_related('cart').get(pk=order_id)
+    logger.info('Заказ %s: товаров %s на сумму %s, способ получения %s', order.id, order.cart.total_products,
+                order.cart.final_price, order.buying_type)
+
+
+@task()
+def generate_product_renditions(model_name, product_id):
+    # Копии готовит воркер очереди: задача переживёт перезапуск сервера, а при ошибке будет повторена
+    product = apps.get_model('mainapp', model_name)._base_manager.filter(pk=product_id).first()
+    if product is None or not product.image_hash:
+        return
+    generate_renditions(product.image.name, product.image_hash)
+    product.renditions_ready()
+
+
+def enqueue_order_tasks(order):
+    send_order_confirmation.delay(order.id)
+    start_order_processing.delay(order.id)
+    record_order_analytics.delay(order.id)
@@ -0,0 +1,28 @@
+from django import template
+from django.utils.html import format_html
+
+from mainapp.images import get_rendition_srcset
+
+register = template.Library()
+
+# Ширина, которую карточка занимает на странице, по ней браузер выбирает копию из srcset
+IMAGE_SIZES = {
+    'card': '(min-width: 1200px) 25vw, (min-width: 768px) 33vw, 50vw',
+    'detail': '(min-width: 768px) 33vw, 100vw',
+    'cart': '25vw',
+}
+
+
+@register.simple_tag
+def product_image(product, sizes, css_class=''):
+    # Пока копии не готовы, отдаём исходное изображение
+    srcset = product.image_hash and get_rendition_srcset(product.image_hash)
+    if not srcset:
+        return format_html('<img class="{}" src="{}" alt="{}"/>', css_class, product.image.url, product.title)
+    img = format_html('<img class="{}" src="{}" srcset="{}" sizes="{}" alt="{}"/>',
+                      css_class, product.image.url, srcset, IMAGE_SIZES[sizes], product.title)
+    webp_srcset = get_rendition_srcset(product.image_hash, 'webp')
+    if not webp_srcset:
+        return img
+    return format_html('<picture><source type="image/webp" srcset="{}" sizes="{}">{}</picture>',
+                       webp_srcset, IMAGE_SIZES[sizes], img)
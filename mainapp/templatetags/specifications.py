@@ -1,8 +1,10 @@
+from types import MappingProxyType
+
 from django import template
+from django.core.cache import cache
+from django.utils.html import conditional_escape, escape
 from django.utils.safestring import mark_safe
 
-from mainapp.models import Smartphone
-
 register = template.Library()
 
 TABLE_HEAD = """
@@ -22,42 +24,76 @@ TABLE_CONTENT = """
 </tr>
 """
 
-PRODUCT_SPEC = {
-    'notebook': {
-        'Диагональ': 'diagonal',
-        'Тип дисплея': 'display_type',
-        'Частота процессора': 'processor_freq',
-        'Оперативная память': 'ram',
-        'Видеокарта': 'video',
-        'Время без подзарядки': 'time_without_charge'
-    },
-    'smartphone': {
-        'Диагональ': 'diagonal',
-        'Тип дисплея': 'display_type',
-        'Разрешение экрана': 'resolution',
-        'Обём аккамулятора': 'accum_volume',
-        'Объём оперативной памяти': 'ram',
-        'Возможность вставить SD карту': 'sd',
-        'Максимальный объём SD карты': 'sd_max_volume',
-        'Разрешение главной камеры': 'main_cam_mp',
-        'Разрешение фронтальной камеры': 'front_cam_mp'
-    }
-}
+PRODUCT_SPEC = MappingProxyType({
+    'notebook': (
+        ('Диагональ', 'diagonal'),
+        ('Тип дисплея', 'display_type'),
+        ('Частота процессора', 'processor_freq'),
+        ('Оперативная память', 'ram'),
+        ('Видеокарта', 'video'),
+        ('Время без подзарядки', 'time_without_charge'),
+    ),
+    'smartphone': (
+        ('Диагональ', 'diagonal'),
+        ('Тип дисплея', 'display_type'),
+        ('Разрешение экрана', 'resolution'),
+        ('Обём аккамулятора', 'accum_volume'),
+        ('Объём оперативной памяти', 'ram'),
+        ('Возможность вставить SD карту', 'sd'),
+        ('Максимальный объём SD карты', 'sd_max_volume'),
+        ('Разрешение главной камеры', 'main_cam_mp'),
+        ('Разрешение фронтальной камеры', 'front_cam_mp'),
+    )
+})
+
+# Строка выводится, только если у товара истинно указанное поле
+SPEC_FIELD_CONDITIONS = MappingProxyType({
+    'sd_max_volume': 'sd'
+})
+
+SPEC_CACHE_KEY = 'product_spec:{model_name}:{pk}'
+
+
+def compile_spec_rows(spec):
+    # Разметка строк собирается один раз при импорте, при выводе подставляются только значения
+    prefix, suffix = TABLE_CONTENT.split('{value}')
+    return tuple(
+        (field, SPEC_FIELD_CONDITIONS.get(field), prefix.format(name=escape(name)), suffix)
+        for name, field in spec
+    )
+
+
+COMPILED_PRODUCT_SPEC = MappingProxyType({
+    model_name: compile_spec_rows(spec) for model_name, spec in PRODUCT_SPEC.items()
+})
 
 
 def get_product_spec(product, model_name):
-    table_content = ''
-    for name, value in PRODUCT_SPEC[model_name].items():
-        table_content += TABLE_CONTENT.format(name=name, value=getattr(product, value))
-    return table_content
+    parts = [TABLE_HEAD]
+    for field, condition, prefix, suffix in COMPILED_PRODUCT_SPEC[model_name]:
+        if condition and not getattr(product, condition):
+            continue
+        parts.extend((prefix, conditional_escape(getattr(product, field)), suffix))
+    parts.append(TABLE_TAIL)
+    return ''.join(parts)
+
+
+def get_spec_cache_key(product):
+    return SPEC_CACHE_KEY.format(model_name=product._meta.model_name, pk=product.pk)
+
+
+def invalidate_product_spec(product):
+    cache.delete(get_spec_cache_key(product))
 
 
 @register.filter
 def product_spec(product):
-    model_name = product.__class__._meta.model_name
-    if isinstance(product, Smartphone):
-        if not product.sd:
-            PRODUCT_SPEC['smartphone'].pop('Максимальный объем SD карты', None)
-        else:
-            PRODUCT_SPEC['smartphone']['Максимальный объем SD карты'] = 'sd_max_volume'
-    return mark_safe(TABLE_HEAD + get_product_spec(product, model_name) + TABLE_TAIL)
+    model_name = product._meta.model_name
+    if product.pk is None:
+        return mark_safe(get_product_spec(product, model_name))
+    cache_key = get_spec_cache_key(product)
+    spec = cache.get(cache_key)
+    if spec is None:
+        spec = get_product_spec(product, model_name)
+        cache.set(cache_key, spec)
+    return mark_safe(spec)
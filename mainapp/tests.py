@@ -1,3 +1,1070 @@
-from django.test import TestCase
+import asyncio
+import csv
+import os
+import shutil
+import tempfile
+import threading
+import uuid
+from datetime import timedelta
+from decimal import Decimal
+from io import BytesIO, StringIO
 
-# Create your tests here.
+from PIL import Image
+from django.contrib import admin
+from django.contrib.auth import get_user_model
+from django.contrib.contenttypes.models import ContentType
+from django.contrib.sessions.models import Session
+from django.core.cache import cache, caches
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core import mail
+from django.core.management import call_command
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.db import connection, connections
+from django.db.models import Count, Sum
+from django.http import QueryDict
+from django.test import Client, RequestFactory, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import include, path, resolve, reverse
+from django.utils import timezone
+from django.utils.html import escape
+
+from .admin import StockAdmin
+from .cart import CookieCart
+from .async_views import AsyncBaseView, AsyncCategoryDetailView, AsyncProductDetailView
+from .templatetags.specifications import product_spec
+from .search import SEARCH_PER_PAGE, index_product, search_products
+from .profiling import QueryBudgetExceeded, reset_stats
+from .images import (
+    RENDITION_MANIFEST, RENDITIONS_DIR, generate_renditions, get_rendition_dir, get_rendition_manifest,
+    get_rendition_name, reset_rendition_manifests
+)
+from .export import ORDER_EXPORT_FIELDS, get_product_export_fields, iter_order_rows, render_rows
+from .models import (
+    CatalogProduct, Cart, CartProducts, Categories, Customers, InvalidImageException, LatestProducts,
+    MaxImageSizeException, MaxResolutionException, MinResolutionException, Notebook, Orders, OutOfStockException,
+    Products, Smartphone, Stock, StockReservation, Task
+)
+from .tasks import run_next_task, task
+from .views import ProductDetailView, RenditionView
+from .utils import CATALOG_MODIFIED_KEY, PRODUCT_SORT_ORDERING, KeysetPaginator, calc_cart
+
+User = get_user_model()
+
+MEDIA_ROOT = tempfile.mkdtemp()
+# Свой кеш на каждый запуск: cache.clear() в тестах не должен задевать кеш работающего сервера
+CACHE_ROOT = tempfile.mkdtemp()
+TEST_SETTINGS = {
+    'MEDIA_ROOT': MEDIA_ROOT,
+    'CACHES': {
+        'default': {
+            'BACKEND': 'mainapp.profiling.ProfilingFileBasedCache',
+            'LOCATION': CACHE_ROOT,
+        }
+    },
+    'QUERY_BUDGETS_RAISE': True,
+}
+
+
+def make_image(name='test.png', size=(400, 400)):
+    stream = BytesIO()
+    Image.new('RGB', size, 'white').save(stream, 'PNG')
+    return SimpleUploadedFile(name, stream.getvalue(), content_type='image/png')
+
+
+def make_notebook(category, number):
+    return Notebook.objects.create(
+        title=f'Ноутбук {number}', slug=f'notebook-{number}', image=make_image(), description='Описание',
+        price=Decimal('1000.00') + number, category=category, diagonal='15.6', display_type='IPS',
+        processor_freq='3.4 GHz', ram='8 GB', video='GeForce', time_without_charge='8 часов'
+    )
+
+
+def make_smartphone(category, number, **fields):
+    fields = {
+        'diagonal': '6.1', 'display_type': 'OLED', 'resolution': '2532x1170', 'accum_volume': '3000 mAh',
+        'ram': '4 GB', 'sd': False, 'main_cam_mp': '12 MP', 'front_cam_mp': '12 MP', **fields
+    }
+    return Smartphone.objects.create(
+        title=f'Смартфон {number}', slug=f'smartphone-{number}', image=make_image(), description='Описание',
+        price=Decimal('500.00') + number, category=category, **fields
+    )
+
+
+def log_in_with_cookies(client, user):
+    # client.login() создаёт запрос без cookie клиента, а корзину гостя нужно перенести при настоящем входе
+    User.objects.filter(pk=user.pk).update(is_staff=True)
+    client.post(reverse('admin:login'), {'username': user.username, 'password': 'password'})
+
+
+@override_settings(**TEST_SETTINGS)
+class ShopTestCase(TestCase):
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        shutil.rmtree(MEDIA_ROOT, ignore_errors=True)
+        shutil.rmtree(CACHE_ROOT, ignore_errors=True)
+
+    def setUp(self):
+        cache.clear()
+        reset_rendition_manifests()
+        self.category = Categories.objects.create(name='Ноутбуки', slug='notebooks')
+        Categories.objects.create(name='Смартфоны', slug='smartphones')
+        self.user = User.objects.create_user(username='buyer', password='password')
+        self.customer = Customers.objects.create(user=self.user)
+        self.cart = Cart.objects.create(owner=self.customer)
+        self.client.force_login(self.user)
+
+    def fill_cart(self, count, start=0):
+        content_type = ContentType.objects.get_for_model(Notebook)
+        for number in range(start, start + count):
+            notebook = make_notebook(self.category, number)
+            cart_product = CartProducts.objects.create(
+                user=self.customer, cart=self.cart, content_type=content_type, object_id=notebook.id
+            )
+            self.cart.products.add(cart_product)
+        calc_cart(self.cart)
+
+
+class CartQueriesTest(ShopTestCase):
+
+    def count_queries(self, url):
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return len(context.captured_queries)
+
+    def test_cart_queries_do_not_grow_with_items(self):
+        for url in (reverse('cart'), reverse('checkout')):
+            with self.subTest(url=url):
+                self.client.get(url)
+                self.fill_cart(2, start=len(self.cart.products.all()))
+                small_cart_queries = self.count_queries(url)
+                self.fill_cart(10, start=len(self.cart.products.all()))
+                self.assertEqual(self.count_queries(url), small_cart_queries)
+
+    def test_cart_page_queries_items_once(self):
+        self.fill_cart(3)
+        self.client.get(reverse('cart'))
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(reverse('cart'))
+        self.assertContains(response, 'Ноутбук 2')
+        item_queries = [query for query in context.captured_queries if 'mainapp_cartproducts' in query['sql']]
+        self.assertEqual(len(item_queries), 1)
+        self.assertEqual(response.context['cart'].total_products, 3)
+
+
+
+class CartTotalsTest(ShopTestCase):
+
+    def assert_totals_match_items(self, cart):
+        cart.refresh_from_db()
+        items = cart.products.aggregate(final_price=Sum('final_price'), total_products=Count('id'))
+        self.assertEqual(cart.total_products, items['total_products'])
+        self.assertEqual(cart.final_price, items['final_price'] or 0)
+
+    def test_cart_changes_keep_totals_equal_to_items(self):
+        content_type = ContentType.objects.get_for_model(Notebook)
+        notebooks = [make_notebook(self.category, number) for number in range(3)]
+        for notebook in notebooks:
+            self.cart.add_product(content_type, notebook)
+            self.assert_totals_match_items(self.cart)
+        self.cart.change_quantity(content_type, notebooks[0], 3)
+        self.assert_totals_match_items(self.cart)
+        self.cart.remove_product(content_type, notebooks[1])
+        self.assert_totals_match_items(self.cart)
+        notebooks[2].delete()
+        self.assert_totals_match_items(self.cart)
+        self.assertEqual((self.cart.total_products, self.cart.final_price), (1, notebooks[0].price * 3))
+
+    def test_recalc_carts_finds_and_repairs_drift(self):
+        self.fill_cart(2)
+        Cart.objects.filter(pk=self.cart.pk).update(total_products=5, final_price=1)
+        stdout = StringIO()
+        call_command('recalc_carts', '--check', stdout=stdout)
+        self.assertIn(f'Корзина {self.cart.id}: 5 / 1.00', stdout.getvalue())
+        self.assertEqual(Cart.objects.get(pk=self.cart.pk).total_products, 5)
+        call_command('recalc_carts', stdout=StringIO())
+        self.assert_totals_match_items(self.cart)
+        stdout = StringIO()
+        call_command('recalc_carts', '--check', stdout=stdout)
+        self.assertIn('Найдено корзин с расхождениями: 0', stdout.getvalue())
+
+
+class LatestProductsTest(ShopTestCase):
+
+    def setUp(self):
+        super().setUp()
+        smartphones = Categories.objects.get(slug='smartphones')
+        self.notebooks = [make_notebook(self.category, number) for number in range(7)]
+        self.smartphones = [make_smartphone(smartphones, number) for number in range(2)]
+
+    def get_titles(self, *args, **kwargs):
+        return [product.title for product in LatestProducts.objects.get_products_for_main_page(*args, **kwargs)]
+
+    def test_newest_products_of_each_model_in_argument_order(self):
+        expected = [product.title for product in self.notebooks[:1:-1] + self.smartphones[::-1]]
+        self.assertEqual(self.get_titles('notebook', 'smartphone'), expected)
+        with self.assertNumQueries(0):
+            self.assertEqual(self.get_titles('notebook', 'smartphone'), expected)
+
+    def test_with_respect_to_puts_model_first(self):
+        expected = [product.title for product in self.smartphones[::-1] + self.notebooks[:1:-1]]
+        self.assertEqual(self.get_titles('notebook', 'smartphone', with_respect_to='smartphone'), expected)
+        # Модель не из списка порядок не меняет
+        self.assertEqual(self.get_titles('notebook', with_respect_to='smartphone'),
+                         [product.title for product in self.notebooks[:1:-1]])
+
+    def test_feed_is_updated_on_save_and_delete(self):
+        self.get_titles('notebook')
+        newest = make_notebook(self.category, 7)
+        self.assertEqual(self.get_titles('notebook')[0], newest.title)
+        self.notebooks[6].title = 'Новое название'
+        self.notebooks[6].save()
+        self.assertIn('Новое название', self.get_titles('notebook'))
+        newest.delete()
+        self.assertNotIn(newest.title, self.get_titles('notebook'))
+        self.assertEqual(len(self.get_titles('notebook')), LatestProducts.objects.PRODUCTS_COUNT)
+
+
+class CategoriesForShopTest(ShopTestCase):
+
+    def get_counts(self):
+        return {category['name']: category['count'] for category in Categories.objects.get_categories_for_shop()}
+
+    def test_warm_call_makes_no_queries(self):
+        make_notebook(self.category, 1)
+        counts = self.get_counts()
+        with self.assertNumQueries(0):
+            self.assertEqual(self.get_counts(), counts)
+
+    def test_counts_follow_created_and_deleted_products(self):
+        self.assertEqual(self.get_counts(), {'Ноутбуки': 0, 'Смартфоны': 0})
+        notebook = make_notebook(self.category, 1)
+        make_smartphone(Categories.objects.get(slug='smartphones'), 1)
+        self.assertEqual(self.get_counts(), {'Ноутбуки': 1, 'Смартфоны': 1})
+        notebook.delete()
+        self.assertEqual(self.get_counts(), {'Ноутбуки': 0, 'Смартфоны': 1})
+
+
+class CatalogProductSyncTest(ShopTestCase):
+
+    def get_catalog_product(self, product):
+        return CatalogProduct.objects.get(content_type=ContentType.objects.get_for_model(product), object_id=product.id)
+
+    def test_create_and_update_are_copied(self):
+        notebook = make_notebook(self.category, 1)
+        catalog_product = self.get_catalog_product(notebook)
+        self.assertEqual((catalog_product.title, catalog_product.slug, catalog_product.price, catalog_product.image),
+                         (notebook.title, notebook.slug, notebook.price, notebook.image.name))
+        notebook.title, notebook.slug, notebook.price = 'Новое название', 'renamed', Decimal('99.00')
+        notebook.save()
+        catalog_product = self.get_catalog_product(notebook)
+        self.assertEqual((catalog_product.title, catalog_product.slug, catalog_product.price),
+                         ('Новое название', 'renamed', Decimal('99.00')))
+        self.assertEqual(CatalogProduct.objects.count(), 1)
+
+    def test_category_change_moves_product(self):
+        notebook = make_notebook(self.category, 1)
+        other = Categories.objects.get(slug='smartphones')
+        notebook.category = other
+        notebook.save()
+        self.assertEqual(self.get_catalog_product(notebook).category_id, other.id)
+        response = self.client.get(reverse('catalog'), {'category': self.category.slug})
+        self.assertNotContains(response, notebook.title)
+        self.assertContains(self.client.get(reverse('catalog'), {'category': other.slug}), notebook.title)
+
+    def test_delete_removes_only_own_row(self):
+        notebook = make_notebook(self.category, 1)
+        smartphone = make_smartphone(Categories.objects.get(slug='smartphones'), 1)
+        # У товаров разных моделей могут совпадать id, строки различаются по content_type
+        self.assertEqual(notebook.id, smartphone.id)
+        notebook.delete()
+        self.assertFalse(CatalogProduct.objects.filter(title=notebook.title).exists())
+        self.assertEqual(self.get_catalog_product(smartphone).title, smartphone.title)
+
+class CookieCartTest(ShopTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.notebooks = [make_notebook(self.category, number) for number in range(2)]
+        self.client.logout()
+
+    def cart_url(self, name, notebook):
+        return reverse(name, kwargs={'ct_model': 'notebook', 'slug': notebook.slug})
+
+    def test_anonymous_cart_changes_do_not_write_to_database(self):
+        with CaptureQueriesContext(connection) as queries:
+            for notebook in self.notebooks:
+                self.client.get(self.cart_url('add_to_cart', notebook))
+            self.client.post(self.cart_url('change_quantity', self.notebooks[0]), {'quantity': 3})
+            self.client.get(self.cart_url('delete_from_cart', self.notebooks[1]))
+        self.assertFalse([query['sql'] for query in queries.captured_queries
+                          if query['sql'].startswith(('INSERT', 'UPDATE', 'DELETE'))])
+        self.assertFalse(Session.objects.exists())
+        cart = self.client.get(reverse('cart')).context['cart']
+        self.assertEqual([(item.content_object, item.quantity) for item in cart.get_products()],
+                         [(self.notebooks[0], 3)])
+
+    def test_cart_is_merged_into_user_cart_on_login(self):
+        content_type = ContentType.objects.get_for_model(Notebook)
+        self.cart.add_product(content_type, self.notebooks[0])
+        for notebook in self.notebooks:
+            self.client.get(self.cart_url('add_to_cart', notebook))
+        self.client.post(self.cart_url('change_quantity', self.notebooks[1]), {'quantity': 2})
+        log_in_with_cookies(self.client, self.user)
+        self.assertEqual(self.client.cookies[CookieCart.COOKIE_NAME].value, '')
+        self.assertCountEqual(
+            self.cart.products.values_list('object_id', 'quantity'),
+            [(self.notebooks[0].id, 2), (self.notebooks[1].id, 2)]
+        )
+        self.cart.refresh_from_db()
+        self.assertEqual(self.cart.total_products, 2)
+
+    def test_tampered_cookie_is_ignored(self):
+        self.client.get(self.cart_url('add_to_cart', self.notebooks[0]))
+        self.client.cookies[CookieCart.COOKIE_NAME] = self.client.cookies[CookieCart.COOKIE_NAME].value + 'x'
+        self.assertEqual(self.client.get(reverse('cart')).context['cart'].total_products, 0)
+
+
+class DetailQueriesTest(ShopTestCase):
+
+    def count_table_queries(self, url, table):
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return len([query for query in context.captured_queries if f'FROM "{table}"' in query['sql']])
+
+    def test_category_page_fetches_category_once(self):
+        make_notebook(self.category, 1)
+        Categories.objects.get_categories_for_shop()
+        self.assertEqual(self.count_table_queries(self.category.get_absolute_url(), 'mainapp_categories'), 1)
+
+    def test_product_page_fetches_product_once(self):
+        notebook = make_notebook(self.category, 1)
+        Categories.objects.get_categories_for_shop()
+        self.assertEqual(self.count_table_queries(notebook.get_absolute_url(), 'mainapp_notebook'), 1)
+
+
+
+class ProductPageCacheTest(ShopTestCase):
+    CART_BADGE = '<span class="badge bg-dark text-white ms-1 rounded-pill">{}</span>'
+
+    def setUp(self):
+        super().setUp()
+        self.notebook = make_notebook(self.category, 1)
+        self.url = self.notebook.get_absolute_url()
+
+    def test_warm_anonymous_page_makes_no_queries(self):
+        self.client.logout()
+        self.client.get(self.url)
+        with self.assertNumQueries(0):
+            response = self.client.get(self.url)
+        self.assertContains(response, self.notebook.title)
+
+    def test_cart_badge_is_filled_per_user(self):
+        self.fill_cart(2, start=2)
+        self.assertContains(self.client.get(self.url), self.CART_BADGE.format(2))
+        other = User.objects.create_user(username='other', password='password')
+        Cart.objects.create(owner=Customers.objects.create(user=other))
+        self.client.force_login(other)
+        response = self.client.get(self.url)
+        self.assertContains(response, self.CART_BADGE.format(0))
+        self.assertNotContains(response, ProductDetailView.CART_BADGE_PLACEHOLDER)
+
+    def test_save_invalidates_cached_page(self):
+        self.client.get(self.url)
+        self.notebook.title = 'Новое название'
+        self.notebook.save()
+        self.assertContains(self.client.get(self.url), 'Новое название')
+
+    def test_delete_invalidates_cached_page(self):
+        self.client.get(self.url)
+        self.notebook.delete()
+        self.assertEqual(self.client.get(self.url).status_code, 404)
+
+    def test_slug_change_invalidates_old_address(self):
+        self.client.get(self.url)
+        self.notebook.slug = 'renamed'
+        self.notebook.save()
+        self.assertEqual(self.client.get(self.url).status_code, 404)
+        self.assertContains(self.client.get(self.notebook.get_absolute_url()), self.notebook.title)
+
+
+class ProductSpecTest(ShopTestCase):
+
+    def test_values_are_escaped(self):
+        notebook = make_notebook(self.category, 1)
+        notebook.ram = '<b>8 GB</b>'
+        spec = product_spec(notebook)
+        self.assertIn('<td>&lt;b&gt;8 GB&lt;/b&gt;</td>', spec)
+        self.assertNotIn('<b>', spec)
+
+    def test_sd_volume_row_depends_on_sd(self):
+        category = Categories.objects.get(slug='smartphones')
+        without_sd = make_smartphone(category, 1)
+        with_sd = make_smartphone(category, 2, sd=True, sd_max_volume='256 GB')
+        self.assertNotIn('Максимальный объём SD карты', product_spec(without_sd))
+        self.assertInHTML('<tr><td>Максимальный объём SD карты</td><td>256 GB</td></tr>', product_spec(with_sd))
+
+    def test_cached_spec_is_invalidated_on_save(self):
+        notebook = make_notebook(self.category, 1)
+        product_spec(notebook)
+        notebook.ram = '16 GB'
+        # Без сохранения отдаётся закешированная таблица
+        self.assertNotIn('16 GB', product_spec(notebook))
+        notebook.save()
+        self.assertIn('16 GB', product_spec(Notebook.objects.get(pk=notebook.pk)))
+
+class KeysetPaginationTest(ShopTestCase):
+
+    def setUp(self):
+        super().setUp()
+        notebooks = [make_notebook(self.category, number) for number in range(7)]
+        # Одинаковые цены и названия проверяют, что соседние страницы разделяет id
+        for notebook in notebooks[:4]:
+            CatalogProduct.objects.filter(object_id=notebook.id).update(price=Decimal('500'), title='Ноутбук')
+        self.ids = set(CatalogProduct.objects.values_list('id', flat=True))
+
+    def test_every_sort_walks_all_pages_without_duplicates_or_gaps(self):
+        for sort, ordering in PRODUCT_SORT_ORDERING.items():
+            with self.subTest(sort=sort):
+                paginator = KeysetPaginator(CatalogProduct.objects.all(), ordering, per_page=2)
+                page = paginator.get_page()
+                seen = [product.id for product in page]
+                while page.has_next:
+                    page = paginator.get_page(page.next_cursor)
+                    seen += [product.id for product in page]
+                self.assertEqual(len(seen), len(set(seen)))
+                self.assertEqual(set(seen), self.ids)
+                self.assertEqual(seen, list(CatalogProduct.objects.order_by(*ordering).values_list('id', flat=True)))
+
+    def test_first_page_link_keeps_filters(self):
+        filters = {'sort': 'price', 'category': 'notebooks', 'q': 'ноутбук', 'min_price': '1', 'max_price': '5000'}
+        paginator = KeysetPaginator(CatalogProduct.objects.all(), PRODUCT_SORT_ORDERING['price'], per_page=2)
+        response = self.client.get(reverse('catalog'), {**filters, 'cursor': paginator.get_page().next_cursor})
+        self.assertContains(response, f'href="?{escape(response.context["first_page_query"])}"')
+        self.assertEqual(QueryDict(response.context['first_page_query']).dict(), filters)
+
+
+class FacetTest(ShopTestCase):
+
+    def setUp(self):
+        super().setUp()
+        for number, (ram, diagonal) in enumerate([('8 GB', '15.6'), ('8 GB', '13.3'), ('16 GB', '15.6')]):
+            notebook = make_notebook(self.category, number)
+            notebook.ram, notebook.diagonal = ram, diagonal
+            notebook.save()
+
+    def get_counts(self, response):
+        return {facet['name']: {value['value']: value['count'] for value in facet['values']}
+                for facet in response.context['facets'] if facet['name'] in ('ram', 'diagonal')}
+
+    def test_counts_respect_selection_in_other_facets(self):
+        response = self.client.get(self.category.get_absolute_url(), {'ram': '8'})
+        self.assertEqual(len(response.context['category_products']), 2)
+        # Счётчики фасета не сужаются его собственным выбором, но учитывают выбор в остальных
+        self.assertEqual(self.get_counts(response), {'ram': {'8': 2, '16': 1}, 'diagonal': {'13.3': 1, '15.6': 1}})
+        response = self.client.get(self.category.get_absolute_url(), {'ram': '8', 'diagonal': '15.6'})
+        self.assertEqual(len(response.context['category_products']), 1)
+        self.assertEqual(self.get_counts(response), {'ram': {'8': 1, '16': 1}, 'diagonal': {'13.3': 1, '15.6': 1}})
+
+    def test_first_page_link_keeps_facets(self):
+        response = self.client.get(self.category.get_absolute_url(), {'ram': '8', 'sort': 'price', 'cursor': 'x'})
+        self.assertEqual(QueryDict(response.context['first_page_query']).dict(), {'ram': '8', 'sort': 'price'})
+        self.assertContains(response, f'href="?{escape(response.context["first_page_query"])}"')
+
+
+class ProductApiTest(ShopTestCase):
+
+    def test_notebooks_revalidate_until_catalog_changes(self):
+        make_notebook(self.category, 1)
+        url = reverse('api_notebooks')
+        etag = self.client.get(url)['ETag']
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        make_notebook(self.category, 2)
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.json()['results']), 2)
+
+    def test_changes_from_other_processes_are_seen_after_timeout(self):
+        notebook = make_notebook(self.category, 2)
+        url = reverse('api_notebooks')
+        etag = self.client.get(url)['ETag']
+        # Запись из другого процесса: сигналы здесь не срабатывают, а отметка в кеше истекает по таймауту
+        Notebook.objects.filter(pk=notebook.pk).update(title='Изменён', updated_at=timezone.now())
+        cache.delete(CATALOG_MODIFIED_KEY.format(model_name='notebook'))
+        etag_after_update = self.client.get(url)['ETag']
+        self.assertNotEqual(etag_after_update, etag)
+        notebook.delete()
+        cache.delete(CATALOG_MODIFIED_KEY.format(model_name='notebook'))
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag_after_update).status_code, 200)
+
+    def test_fields_limit_response(self):
+        make_notebook(self.category, 1)
+        response = self.client.get(reverse('api_notebooks'), {'fields': 'title,category'})
+        self.assertEqual(response.json()['results'], [
+            {'title': 'Ноутбук 1', 'category': {'id': self.category.id, 'name': 'Ноутбуки', 'slug': 'notebooks'}}
+        ])
+
+
+class SearchTest(ShopTestCase):
+
+    def test_title_match_ranks_above_description_match(self):
+        in_description = make_notebook(self.category, 1)
+        in_description.description = 'Игровой ноутбук'
+        in_description.save()
+        in_title = make_notebook(self.category, 2)
+        in_title.title = 'Игровой ноутбук'
+        in_title.save()
+        response = self.client.get(reverse('search'), {'q': 'игров'})
+        self.assertEqual([product.object_id for product in response.context['products']],
+                         [in_title.id, in_description.id])
+        response = self.client.get(reverse('api_search'), {'q': 'игров'})
+        self.assertEqual([product['title'] for product in response.json()['results']],
+                         ['Игровой ноутбук', 'Ноутбук 1'])
+
+    def test_pages_cover_all_results_once(self):
+        notebooks = [make_notebook(self.category, number) for number in range(SEARCH_PER_PAGE + 1)]
+        response = self.client.get(reverse('search'), {'q': 'ноутбук'})
+        self.assertTrue(response.context['has_next'])
+        found = [product.object_id for product in response.context['products']]
+        response = self.client.get(reverse('search'), {'q': 'ноутбук', 'page': 2})
+        self.assertFalse(response.context['has_next'])
+        found += [product.object_id for product in response.context['products']]
+        self.assertCountEqual(found, [notebook.id for notebook in notebooks])
+
+        response = self.client.get(reverse('api_search'), {'q': 'ноутбук'}).json()
+        titles = [product['title'] for product in response['results']]
+        response = self.client.get(response['next']).json()
+        self.assertIsNone(response['next'])
+        titles += [product['title'] for product in response['results']]
+        self.assertCountEqual(titles, [notebook.title for notebook in notebooks])
+
+    def test_saved_and_deleted_products_are_reindexed(self):
+        notebook = make_notebook(self.category, 1)
+        notebook.title = 'Ультрабук'
+        notebook.save()
+        self.assertEqual(search_products('ноутбук'), ([], False))
+        self.assertEqual([product.object_id for product in search_products('ультрабук')[0]], [notebook.id])
+        notebook.delete()
+        self.assertEqual(search_products('ультрабук'), ([], False))
+
+    def test_reindex_deletes_by_rowid(self):
+        notebook = make_notebook(self.category, 1)
+        with CaptureQueriesContext(connection) as queries:
+            index_product(notebook)
+        delete_sql = next(query['sql'] for query in queries.captured_queries if query['sql'].startswith('DELETE'))
+        with connection.cursor() as cursor:
+            cursor.execute(f'EXPLAIN QUERY PLAN {delete_sql}')
+            plan = ' '.join(str(row[-1]) for row in cursor.fetchall())
+        # FTS5 помечает поиск по rowid как "INDEX 0:=", полный перебор таблицы - как "INDEX 0:"
+        self.assertIn('INDEX 0:=', plan)
+
+
+class ConditionalPageTest(ShopTestCase):
+
+    def test_unchanged_pages_return_not_modified(self):
+        notebook = make_notebook(self.category, 1)
+        urls = (reverse('main'), self.category.get_absolute_url(), notebook.get_absolute_url())
+        for number, url in enumerate(urls, start=2):
+            with self.subTest(url=url):
+                etag = self.client.get(url)['ETag']
+                self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+                make_notebook(self.category, number)
+                self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+    def test_anonymous_page_is_public(self):
+        self.client.logout()
+        response = self.client.get(reverse('main'))
+        self.assertIn('public', response['Cache-Control'])
+        self.assertTrue(response.has_header('Last-Modified'))
+        self.client.force_login(self.user)
+        response = self.client.get(reverse('main'))
+        self.assertIn('private', response['Cache-Control'])
+        self.assertFalse(response.has_header('Last-Modified'))
+
+
+class RenditionTest(ShopTestCase):
+
+    def test_renditions_are_served_by_django_only_in_debug(self):
+        name = f'{RENDITIONS_DIR}/ab/cd/320.jpeg'
+        default_storage.save(name, make_image('320.jpeg'))
+        # Тесты идут с DEBUG=False, и копии отдаёт веб-сервер, а не Django
+        self.assertEqual(self.client.get(default_storage.url(name)).status_code, 404)
+        response = RenditionView.as_view()(RequestFactory().get('/'), path='ab/cd/320.jpeg')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Cache-Control'], RenditionView.CACHE_CONTROL)
+
+    def test_renditions_are_generated_by_task_queue(self):
+        self.client.logout()
+        with self.captureOnCommitCallbacks(execute=True):
+            notebook = make_notebook(self.category, 1)
+        self.assertNotContains(self.client.get(notebook.get_absolute_url()), 'srcset')
+        self.assertTrue(run_next_task('worker'))
+        self.assertEqual(Task.objects.get().status, Task.STATUS_DONE)
+        # Закешированная страница товара сбрасывается, когда копии готовы
+        self.assertContains(self.client.get(notebook.get_absolute_url()), 'srcset')
+
+    def test_manifest_is_kept_in_process_memory(self):
+        image_hash = 'ab' * 32
+        self.assertIsNone(get_rendition_manifest(image_hash))
+        manifest_name = f'{get_rendition_dir(image_hash)}/{RENDITION_MANIFEST}'
+        default_storage.save(manifest_name, ContentFile(b'{"widths": [160], "formats": ["jpeg"]}'))
+        # Отсутствие манифеста не запоминается, а готовый манифест больше не читается из общего кеша
+        self.assertEqual(get_rendition_manifest(image_hash)['widths'], [160])
+        cache.clear()
+        default_storage.delete(manifest_name)
+        self.assertEqual(get_rendition_manifest(image_hash)['widths'], [160])
+
+
+
+class ProductImageTest(ShopTestCase):
+
+    def test_renditions_are_not_wider_than_source(self):
+        for size, widths in (((1000, 500), [160, 320, 640, 960]), ((400, 400), [160, 320])):
+            with self.subTest(size=size):
+                image_hash = f'{size[0]:064x}'
+                generate_renditions(default_storage.save('source.png', make_image(size=size)), image_hash)
+                manifest = get_rendition_manifest(image_hash)
+                self.assertEqual(manifest['widths'], widths)
+                for width in widths:
+                    for extension in manifest['formats']:
+                        with default_storage.open(get_rendition_name(image_hash, width, extension)) as file:
+                            self.assertEqual(Image.open(file).width, width)
+
+    def test_renditions_are_reused_for_same_content(self):
+        image_hash = 'ef' * 32
+        generate_renditions(default_storage.save('source.png', make_image()), image_hash)
+        # Повторно исходник не открывается, даже если его уже нет
+        generate_renditions('missing.png', image_hash)
+
+    def test_bad_uploads_are_rejected_by_header(self):
+        stream = BytesIO()
+        Image.new('RGB', (4000, 4000), 'white').save(stream, 'PNG')
+        # Без данных изображения: размеры читаются только из заголовка
+        header_only = stream.getvalue()[:100]
+        cases = (
+            (b'not an image', InvalidImageException),
+            (header_only, MaxResolutionException),
+            (make_image(size=(100, 100)).read(), MinResolutionException),
+            (make_image().read() + b'\0' * Products.MAX_IMAGE_SIZE, MaxImageSizeException),
+        )
+        notebook = make_notebook(self.category, 1)
+        for content, exception in cases:
+            with self.subTest(exception=exception.__name__):
+                notebook.image = SimpleUploadedFile('upload.png', content, content_type='image/png')
+                with self.assertRaises(exception):
+                    notebook.save()
+        self.assertEqual(Notebook.objects.get(pk=notebook.pk).image_hash, notebook.image_hash)
+
+# Адреса витрины как под ASGI с ASYNC_VIEWS: асинхронные страницы стоят перед обычными
+urlpatterns = [
+    path('', AsyncBaseView.as_view(), name='main'),
+    path('products/<str:ct_model>/<str:slug>', AsyncProductDetailView.as_view(), name='product_detail'),
+    path('category/<str:slug>/', AsyncCategoryDetailView.as_view(), name='category_detail'),
+    path('', include('Online_Shop.urls'))
+]
+
+
+@override_settings(**TEST_SETTINGS, ROOT_URLCONF='mainapp.tests')
+class AsyncPageTest(TransactionTestCase):
+
+    def setUp(self):
+        # Запросы к базе идут из потоков пула, им нужны зафиксированные данные и отдельные соединения
+        if connection.vendor == 'sqlite' and connection.is_in_memory_db():
+            self.skipTest('SQLite в памяти не поддерживает запросы из других потоков')
+        cache.clear()
+        reset_rendition_manifests()
+        category = Categories.objects.create(name='Ноутбуки', slug='notebooks')
+        Categories.objects.create(name='Смартфоны', slug='smartphones')
+        self.notebook = make_notebook(category, 1)
+        self.urls = (reverse('main'), category.get_absolute_url(), self.notebook.get_absolute_url())
+        user = User.objects.create_user(username='buyer', password='password')
+        Cart.objects.create(owner=Customers.objects.create(user=user)).add_product(
+            ContentType.objects.get_for_model(Notebook), self.notebook
+        )
+        self.async_client.force_login(user)
+
+    async def test_pages_render_and_return_not_modified(self):
+        for url in self.urls:
+            with self.subTest(url=url):
+                self.assertTrue(asyncio.iscoroutinefunction(resolve(url).func))
+                response = await self.async_client.get(url)
+                self.assertContains(response, self.notebook.title)
+                self.assertIn('private', response['Cache-Control'])
+                # AsyncClient в Django 3.2 принимает заголовки по их именам, а не в виде ключей META
+                response = await self.async_client.get(url, **{'If-None-Match': response['ETag']})
+                self.assertEqual(response.status_code, 304)
+
+    async def test_unknown_method_is_not_allowed(self):
+        # Метод с именем атрибута представления (cart) не должен вызывать этот атрибут
+        for method in ('CART', 'POST'):
+            with self.subTest(method=method):
+                response = await self.async_client.generic(method, self.urls[0])
+                self.assertEqual(response.status_code, 405)
+
+
+class ImportCatalogTest(ShopTestCase):
+
+    def write_feed(self, path, image_name, prices):
+        with open(path, 'w', newline='', encoding='utf-8') as feed:
+            writer = csv.writer(feed)
+            writer.writerow(['title', 'slug', 'image', 'price', 'category', 'diagonal', 'display_type',
+                             'processor_freq', 'ram', 'video', 'time_without_charge'])
+            for number, price in enumerate(prices):
+                writer.writerow([f'Импорт {number}', f'import-{number}', image_name, price, 'notebooks',
+                                 '15.6', 'IPS', '3.4 GHz', '8 GB', 'GeForce', '8 часов'])
+
+    def test_import_creates_then_updates_by_slug(self):
+        image_name = default_storage.save('feed.png', make_image())
+        path = os.path.join(MEDIA_ROOT, 'feed.csv')
+        self.write_feed(path, image_name, [100, 200, 300])
+        call_command('import_catalog', path, model='notebook', batch_size=2, workers=1, stdout=StringIO())
+        self.assertEqual(Notebook.objects.count(), 3)
+        self.assertEqual(CatalogProduct.objects.count(), 3)
+        self.write_feed(path, image_name, [100, 250, 300])
+        call_command('import_catalog', path, model='notebook', batch_size=2, workers=1, stdout=StringIO())
+        self.assertEqual(Notebook.objects.count(), 3)
+        self.assertEqual(Notebook.objects.get(slug='import-1').price, Decimal('250'))
+        self.assertEqual(CatalogProduct.objects.get(slug='import-1').price, Decimal('250'))
+
+    def test_import_is_visible_to_other_processes(self):
+        image_name = default_storage.save('feed.png', make_image())
+        path = os.path.join(MEDIA_ROOT, 'feed.csv')
+        self.write_feed(path, image_name, [100])
+        # Отдельное подключение к кешу, как у воркера сервера, запущенного до импорта
+        server_cache = caches.create_connection('default')
+        server_cache.get(CATALOG_MODIFIED_KEY.format(model_name='notebook'))
+        call_command('import_catalog', path, model='notebook', workers=1, stdout=StringIO())
+        self.assertEqual(server_cache.get(CATALOG_MODIFIED_KEY.format(model_name='notebook')),
+                         Notebook.objects.get(slug='import-0').updated_at)
+
+
+class ExportTest(ShopTestCase):
+
+    def make_order(self, items=3):
+        self.cart = Cart.objects.create(owner=self.customer)
+        self.fill_cart(items, start=Notebook.objects.count())
+        Orders.objects.create(customer=self.customer, cart=self.cart, first_name='Иван', last_name='Иванов', phone='1')
+
+    def export_orders(self):
+        with CaptureQueriesContext(connection) as context:
+            lines = list(render_rows(iter_order_rows(chunk_size=10), ORDER_EXPORT_FIELDS, 'csv'))
+        return lines, len(context.captured_queries)
+
+    def test_order_export_queries_do_not_grow_with_orders(self):
+        self.make_order()
+        lines, queries = self.export_orders()
+        self.assertEqual(len(lines), 4)
+        for _ in range(5):
+            self.make_order()
+        lines, more_queries = self.export_orders()
+        self.assertEqual(len(lines), 19)
+        self.assertEqual(more_queries, queries)
+
+    def post_admin_action(self, model, action, objects):
+        self.client.force_login(User.objects.create_superuser(username='admin', password='password'))
+        url = reverse(f'admin:mainapp_{model._meta.model_name}_changelist')
+        response = self.client.post(url, {'action': action, '_selected_action': [obj.pk for obj in objects]})
+        self.assertTrue(response.streaming)
+        return response, list(csv.DictReader(StringIO(b''.join(response.streaming_content).decode())))
+
+    def test_admin_exports_selected_products(self):
+        notebooks = [make_notebook(self.category, number) for number in range(3)]
+        response, rows = self.post_admin_action(Notebook, 'export_products_csv', notebooks[:2])
+        self.assertEqual(response['Content-Type'], 'text/csv')
+        self.assertEqual(response['Content-Disposition'], 'attachment; filename="notebook.csv"')
+        self.assertEqual(list(rows[0]), get_product_export_fields([Notebook]))
+        self.assertEqual([row['slug'] for row in rows], [notebook.slug for notebook in notebooks[:2]])
+        self.assertEqual((rows[0]['ct_model'], rows[0]['category'], rows[0]['price']),
+                         ('notebook', self.category.slug, str(notebooks[0].price)))
+
+    def test_admin_exports_selected_orders(self):
+        self.make_order(items=2)
+        self.make_order(items=1)
+        response, rows = self.post_admin_action(Orders, 'export_orders_csv', Orders.objects.order_by('id')[:1])
+        self.assertEqual(response['Content-Disposition'], 'attachment; filename="orders.csv"')
+        self.assertEqual(list(rows[0]), ORDER_EXPORT_FIELDS)
+        order = Orders.objects.order_by('id').first()
+        self.assertEqual({row['order_id'] for row in rows}, {str(order.id)})
+        self.assertEqual(len(rows), 2)
+
+
+class CheckoutTest(ShopTestCase):
+
+    def make_order(self, idempotency_key):
+        return self.client.post(reverse('make_order'), {
+            'first_name': 'Иван', 'last_name': 'Иванов', 'phone': '1', 'buying_type': Orders.BUYING_TYPE_SELF,
+            'order_at': '2030-01-01', 'idempotency_key': idempotency_key
+        })
+
+    def test_retry_with_same_key_does_not_create_second_order(self):
+        self.fill_cart(2)
+        idempotency_key = uuid.uuid4()
+        self.make_order(idempotency_key)
+        self.make_order(idempotency_key)
+        self.assertEqual(Orders.objects.count(), 1)
+        self.assertEqual(Orders.objects.get().cart_id, self.cart.id)
+
+    def test_key_used_by_another_customer_creates_own_order(self):
+        idempotency_key = uuid.uuid4()
+        other = Customers.objects.create(user=User.objects.create_user(username='other', password='password'))
+        other_cart = Cart.objects.create(owner=other, total_products=1)
+        Orders.objects.create(customer=other, cart=other_cart, first_name='Пётр', last_name='Петров', phone='2',
+                              idempotency_key=idempotency_key)
+        self.fill_cart(1)
+        self.assertRedirects(self.make_order(idempotency_key), reverse('main'), fetch_redirect_response=False)
+        self.assertEqual(Orders.objects.get(customer=self.customer).cart_id, self.cart.id)
+
+    def test_empty_cart_is_not_ordered(self):
+        self.assertRedirects(self.make_order(uuid.uuid4()), reverse('cart'), fetch_redirect_response=False)
+        self.assertFalse(Orders.objects.exists())
+
+
+@override_settings(**TEST_SETTINGS)
+class ConcurrentCheckoutTest(TransactionTestCase):
+    SUBMITS = 100
+
+    def test_parallel_submits_create_one_order(self):
+        if connection.vendor == 'sqlite' and connection.is_in_memory_db():
+            self.skipTest('SQLite в памяти не поддерживает параллельную запись')
+        category = Categories.objects.create(name='Ноутбуки', slug='notebooks')
+        user = User.objects.create_user(username='buyer', password='password')
+        customer = Customers.objects.create(user=user)
+        cart = Cart.objects.create(owner=customer)
+        cart.add_product(ContentType.objects.get_for_model(Notebook), make_notebook(category, 1))
+        client = Client()
+        client.force_login(user)
+        barrier = threading.Barrier(self.SUBMITS)
+        statuses = []
+
+        def submit(number):
+            # Половина отправок - повтор одной формы, остальные - разные вкладки со своими ключами
+            idempotency_key = uuid.UUID(int=number % 2 or number)
+            thread_client = Client()
+            thread_client.cookies = client.cookies
+            barrier.wait()
+            try:
+                response = thread_client.post(reverse('make_order'), {
+                    'first_name': 'Иван', 'last_name': 'Иванов', 'phone': '1',
+                    'buying_type': Orders.BUYING_TYPE_SELF, 'order_at': '2030-01-01',
+                    'idempotency_key': idempotency_key
+                })
+                statuses.append(response.status_code)
+            finally:
+                connections.close_all()
+
+        threads = [threading.Thread(target=submit, args=(number,)) for number in range(self.SUBMITS)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(statuses, [302] * self.SUBMITS)
+        self.assertEqual(Orders.objects.count(), 1)
+        self.assertEqual(Orders.objects.get().cart_id, cart.id)
+
+
+class StockTest(ShopTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.notebook = make_notebook(self.category, 1)
+        self.content_type = ContentType.objects.get_for_model(Notebook)
+        self.stock = Stock.objects.create(content_type=self.content_type, object_id=self.notebook.id, available=2)
+
+    def assertStock(self, available, reserved):
+        self.stock.refresh_from_db()
+        self.assertEqual((self.stock.available, self.stock.reserved), (available, reserved))
+
+    def test_cart_reserves_and_checkout_sells(self):
+        self.cart.add_product(self.content_type, self.notebook)
+        self.assertStock(1, 1)
+        with self.assertRaises(OutOfStockException):
+            self.cart.change_quantity(self.content_type, self.notebook, 3)
+        self.cart.change_quantity(self.content_type, self.notebook, 2)
+        self.assertStock(0, 2)
+        self.client.post(reverse('make_order'), {
+            'first_name': 'Иван', 'last_name': 'Иванов', 'phone': '1', 'buying_type': Orders.BUYING_TYPE_SELF,
+            'order_at': '2030-01-01', 'idempotency_key': uuid.uuid4()
+        })
+        self.assertTrue(Orders.objects.exists())
+        self.assertStock(0, 0)
+        self.assertFalse(StockReservation.objects.exists())
+
+    def test_expired_reservations_are_released(self):
+        self.cart.add_product(self.content_type, self.notebook)
+        StockReservation.objects.update(expires_at=timezone.now() - timedelta(minutes=1))
+        self.assertEqual(StockReservation.objects.release_expired(), 1)
+        self.assertStock(2, 0)
+
+    def test_anonymous_cart_checks_stock_and_reserves_on_login(self):
+        self.client.logout()
+        add_url = reverse('add_to_cart', kwargs={'ct_model': 'notebook', 'slug': self.notebook.slug})
+        self.client.get(add_url)
+        self.client.post(reverse('change_quantity', kwargs={'ct_model': 'notebook', 'slug': self.notebook.slug}),
+                         {'quantity': 3})
+        self.assertEqual(CookieCart.for_request(self.client.get(reverse('cart')).wsgi_request).lines,
+                         {f'{self.content_type.id}:{self.notebook.id}': 1})
+        self.assertStock(2, 0)
+        self.client.post(reverse('change_quantity', kwargs={'ct_model': 'notebook', 'slug': self.notebook.slug}),
+                         {'quantity': 2})
+        log_in_with_cookies(self.client, self.user)
+        self.assertEqual(StockReservation.objects.get(cart=self.cart).quantity, 2)
+        self.assertStock(0, 2)
+
+    def test_out_of_stock_message_is_shown(self):
+        Stock.objects.update(available=0)
+        for logged_in in (True, False):
+            with self.subTest(logged_in=logged_in):
+                if not logged_in:
+                    self.client.logout()
+                response = self.client.get(
+                    reverse('add_to_cart', kwargs={'ct_model': 'notebook', 'slug': self.notebook.slug}), follow=True
+                )
+                self.assertContains(response, escape(f'Товара "{self.notebook.title}" нет в нужном количестве'))
+                self.assertNotContains(response, 'Товар успешно добавлен')
+
+    def test_admin_edit_keeps_concurrent_reservations(self):
+        model_admin = StockAdmin(Stock, admin.site)
+        request = RequestFactory().post('/')
+        request.user = User.objects.create_superuser(username='admin', password='password')
+        stale = Stock.objects.get(pk=self.stock.pk)
+        form = model_admin.get_form(request, stale, change=True)({'available': 12}, instance=stale)
+        self.assertTrue(form.is_valid())
+        # Пока форма открыта, покупатель откладывает товар в корзину
+        self.cart.add_product(self.content_type, self.notebook)
+        model_admin.save_model(request, form.save(commit=False), form, change=True)
+        self.assertStock(11, 1)
+        self.cart.remove_product(self.content_type, self.notebook)
+        self.assertStock(12, 0)
+
+    def test_product_without_stock_is_unlimited(self):
+        self.stock.delete()
+        self.cart.add_product(self.content_type, self.notebook)
+        self.cart.change_quantity(self.content_type, self.notebook, 100)
+        self.assertEqual(StockReservation.objects.get().quantity, 100)
+
+
+@override_settings(**TEST_SETTINGS)
+class ConcurrentStockTest(TransactionTestCase):
+    BUYERS = 30
+    AVAILABLE = 10
+
+    def test_parallel_buyers_never_oversell(self):
+        if connection.vendor == 'sqlite' and connection.is_in_memory_db():
+            self.skipTest('SQLite в памяти не поддерживает параллельную запись')
+        category = Categories.objects.create(name='Ноутбуки', slug='notebooks')
+        notebook = make_notebook(category, 1)
+        content_type = ContentType.objects.get_for_model(Notebook)
+        Stock.objects.create(content_type=content_type, object_id=notebook.id, available=self.AVAILABLE)
+        carts = []
+        for number in range(self.BUYERS):
+            customer = Customers.objects.create(user=User.objects.create_user(username=f'buyer-{number}'))
+            carts.append(Cart.objects.create(owner=customer))
+        barrier = threading.Barrier(self.BUYERS)
+        results = []
+
+        def buy(cart):
+            barrier.wait()
+            try:
+                cart.add_product(content_type, notebook)
+                results.append(True)
+            except OutOfStockException:
+                results.append(False)
+            finally:
+                connections.close_all()
+
+        threads = [threading.Thread(target=buy, args=(cart,)) for cart in carts]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(results.count(True), self.AVAILABLE)
+        self.assertEqual(len(results), self.BUYERS)
+        stock = Stock.objects.get()
+        self.assertEqual((stock.available, stock.reserved), (0, self.AVAILABLE))
+        self.assertEqual(StockReservation.objects.count(), self.AVAILABLE)
+
+
+@task(max_attempts=2)
+def failing_task():
+    raise ValueError('Ошибка')
+
+
+class TaskQueueTest(ShopTestCase):
+
+    def test_task_is_enqueued_after_commit(self):
+        with self.captureOnCommitCallbacks() as callbacks:
+            failing_task.delay()
+            self.assertFalse(Task.objects.exists())
+        for callback in callbacks:
+            callback()
+        self.assertEqual(Task.objects.get().name, 'mainapp.tests.failing_task')
+
+    def test_failed_task_is_retried_with_backoff(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            failing_task.delay()
+        with self.assertLogs('mainapp.tasks', 'ERROR') as logs:
+            self.assertTrue(run_next_task('worker'))
+        self.assertIn('mainapp.tests.failing_task', logs.output[0])
+        self.assertIn('ValueError: Ошибка', logs.output[0])
+        task_record = Task.objects.get()
+        self.assertEqual((task_record.status, task_record.attempts), (Task.STATUS_PENDING, 1))
+        self.assertGreater(task_record.run_at, timezone.now())
+        self.assertFalse(run_next_task('worker'))
+        Task.objects.update(run_at=timezone.now())
+        with self.assertLogs('mainapp.tasks', 'ERROR'):
+            self.assertTrue(run_next_task('worker'))
+        self.assertEqual(Task.objects.get().status, Task.STATUS_FAILED)
+
+    def test_checkout_enqueues_order_tasks(self):
+        self.user.email = 'buyer@example.com'
+        self.user.save()
+        self.fill_cart(1)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(reverse('make_order'), {
+                'first_name': 'Иван', 'last_name': 'Иванов', 'phone': '1', 'buying_type': Orders.BUYING_TYPE_SELF,
+                'order_at': '2030-01-01', 'idempotency_key': uuid.uuid4()
+            })
+        while run_next_task('worker'):
+            pass
+        self.assertEqual(set(Task.objects.values_list('status', flat=True)), {Task.STATUS_DONE})
+        self.assertEqual(Orders.objects.get().status, Orders.STATUS_IN_PROGRESS)
+        self.assertEqual(len(mail.outbox), 1)
+
+
+class ProfilingTest(ShopTestCase):
+
+    def setUp(self):
+        super().setUp()
+        reset_stats()
+
+    def test_metrics_report_queries_per_view(self):
+        make_notebook(self.category, 1)
+        self.client.get(reverse('main'))
+        self.client.get(reverse('main'))
+        response = self.client.get(reverse('metrics'))
+        self.assertEqual(response['Content-Type'], 'text/plain; version=0.0.4; charset=utf-8')
+        metrics = dict(line.rsplit(' ', 1) for line in response.content.decode().splitlines()
+                       if not line.startswith('#'))
+        self.assertEqual(metrics['shop_requests_total{view="main"}'], '2')
+        self.assertGreater(int(metrics['shop_db_queries_total{view="main"}']), 0)
+        self.assertGreater(float(metrics['shop_template_render_seconds_total{view="main"}']), 0)
+        self.assertGreater(int(metrics['shop_cache_hits_total{view="main"}']), 0)
+
+    def test_metrics_are_local_only(self):
+        self.assertEqual(self.client.get(reverse('metrics'), REMOTE_ADDR='10.0.0.1').status_code, 403)
+        self.assertEqual(self.client.get(reverse('metrics'), HTTP_X_FORWARDED_FOR='10.0.0.1').status_code, 403)
+
+    @override_settings(QUERY_BUDGETS={'main': 1})
+    def test_exceeded_query_budget_fails_request(self):
+        with self.assertRaises(QueryBudgetExceeded):
+            self.client.get(reverse('main'))
+
+    @override_settings(QUERY_BUDGETS={'main': 1}, QUERY_BUDGETS_RAISE=False)
+    def test_exceeded_query_budget_is_logged(self):
+        with self.assertLogs('mainapp.profiling', 'WARNING') as logs:
+            self.assertEqual(self.client.get(reverse('main')).status_code, 200)
+        self.assertIn('при бюджете 1', logs.output[0])
@@ -1,14 +1,29 @@
+from django.conf import settings
 from django.urls import path
 from .views import *
 
+if settings.ASYNC_VIEWS:
+    # Под ASGI страницы витрины на чтение обслуживаются асинхронными вариантами
+    from .async_views import (AsyncBaseView as BaseView, AsyncCategoryDetailView as CategoryDetailView,
+                              AsyncProductDetailView as ProductDetailView)
+
 urlpatterns = [
     path('', BaseView.as_view(), name='main'),
     path('products/<str:ct_model>/<str:slug>', ProductDetailView.as_view(), name='product_detail'),
     path('category/<str:slug>/', CategoryDetailView.as_view(), name='category_detail'),
+    path('catalog/', CatalogView.as_view(), name='catalog'),
+    path('search/', SearchView.as_view(), name='search'),
     path('cart/', CartView.as_view(), name='cart'),
     path('checkout/', CheckoutView.as_view(), name='checkout'),
     path('make-order/', MakeOrderView.as_view(), name='make_order'),
     path('add-to-cart/<str:ct_model>/<str:slug>/', AddToCartView.as_view(), name='add_to_cart'),
     path('remove-from-cart/<str:ct_model>/<str:slug>/', DeleteFromCartView.as_view(), name='delete_from_cart'),
-    path('change-quantity/<str:ct_model>/<str:slug>/', ChangeQuantityView.as_view(), name='change_quantity')
+    path('change-quantity/<str:ct_model>/<str:slug>/', ChangeQuantityView.as_view(), name='change_quantity'),
+    path('metrics/', MetricsView.as_view(), name='metrics')
 ]
+
+if settings.DEBUG:
+    # В продакшене media/renditions/ отдаёт веб-сервер с тем же Cache-Control (см. MEDIA_ROOT в settings)
+    urlpatterns.append(
+        path(f'{settings.MEDIA_URL.lstrip("/")}{RENDITIONS_DIR}/<path:path>', RenditionView.as_view(), name='rendition')
+    )
@@ -1,4 +1,12 @@
+import hashlib
+import uuid
+
+from django.apps import apps
+from django.conf import settings
+from django.core import signing
+from django.core.cache import cache
 from django.db import models
+from django.utils import timezone
 
 
 def calc_cart(cart):
@@ -8,4 +16,162 @@ def calc_cart(cart):
     else:
         cart.final_price = 0
     cart.total_products = cart_data['id__count']
-    cart.save()
+    cart.save(update_fields=['final_price', 'total_products'])
+
+
+def apply_cart_delta(cart, products_delta=0, price_delta=0):
+    # Сдвигаем итоги корзины одним UPDATE без пересчёта всех позиций
+    type(cart).objects.filter(pk=cart.pk).update(
+        total_products=models.F('total_products') + products_delta,
+        final_price=models.F('final_price') + price_delta
+    )
+    cart.total_products += products_delta
+    cart.final_price += price_delta
+
+
+PRODUCT_SORT_ORDERING = {
+    'newest': ('-id',),
+    'price': ('price', 'id'),
+    '-price': ('-price', '-id'),
+    'title': ('title', 'id'),
+}
+
+PRODUCTS_PER_PAGE = 24
+
+
+def get_product_ordering(sort):
+    if sort not in PRODUCT_SORT_ORDERING:
+        sort = 'newest'
+    return sort, PRODUCT_SORT_ORDERING[sort]
+
+
+class KeysetPage:
+
+    def __init__(self, object_list, next_cursor):
+        self.object_list = object_list
+        self.next_cursor = next_cursor
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    @property
+    def has_next(self):
+        return self.next_cursor is not None
+
+
+class KeysetPaginator:
+    """
+    Постраничный вывод по ключу: следующая страница ищется условием на значения полей сортировки
+    последней записи, поэтому любая страница стоит столько же, сколько первая.
+    Последним полем ordering должен быть уникальный ключ (id).
+    """
+    CURSOR_SALT = 'mainapp.keyset'
+
+    def __init__(self, queryset, ordering, per_page=PRODUCTS_PER_PAGE):
+        self.queryset = queryset.order_by(*ordering)
+        self.ordering = ordering
+        self.per_page = per_page
+
+    def get_field_values(self, obj):
+        values = []
+        for field in self.ordering:
+            value = getattr(obj, field.lstrip('-'))
+            values.append(value if isinstance(value, (int, str)) else str(value))
+        return values
+
+    def get_position_filter(self, values):
+        # (a, b) > (x, y)  ==>  a > x OR (a = x AND b > y)
+        position_filter = models.Q()
+        equal = {}
+        for field, value in zip(self.ordering, values):
+            name = field.lstrip('-')
+            lookup = 'lt' if field.startswith('-') else 'gt'
+            position_filter |= models.Q(**equal, **{f'{name}__{lookup}': value})
+            equal[name] = value
+        return position_filter
+
+    def get_page(self, cursor=None):
+        queryset = self.queryset
+        if cursor:
+            try:
+                values = signing.loads(cursor, salt=self.CURSOR_SALT)
+            except signing.BadSignature:
+                values = None
+            if isinstance(values, list) and len(values) == len(self.ordering):
+                queryset = queryset.filter(self.get_position_filter(values))
+        object_list = list(queryset[:self.per_page + 1])
+        next_cursor = None
+        if len(object_list) > self.per_page:
+            object_list = object_list[:self.per_page]
+            next_cursor = signing.dumps(self.get_field_values(object_list[-1]), salt=self.CURSOR_SALT)
+        return KeysetPage(object_list, next_cursor)
+
+
+def get_page_query(query_dict, cursor, param='cursor'):
+    params = query_dict.copy()
+    params[param] = cursor
+    return params.urlencode()
+
+
+def get_first_page_query(query_dict, param='cursor'):
+    # Сортировка, фильтры и фасеты сохраняются, сбрасывается только позиция
+    params = query_dict.copy()
+    params.pop(param, None)
+    return params.urlencode()
+
+
+PRODUCT_PAGE_CACHE_KEY = 'product_page:{ct_model}:{slug}:{version}:{categories}'
+PRODUCT_PAGE_VERSION_KEY = 'product_page_version:{ct_model}:{slug}'
+
+
+def get_product_page_version(ct_model, slug):
+    version_key = PRODUCT_PAGE_VERSION_KEY.format(ct_model=ct_model, slug=slug)
+    version = cache.get(version_key)
+    if version is None:
+        # Версия потерялась (вытеснена или кеш пуст) - начинаем новую, чтобы не отдать устаревшую страницу
+        version = invalidate_product_page(ct_model, slug)
+    return version
+
+
+def invalidate_product_page(ct_model, slug):
+    version = uuid.uuid4().hex
+    cache.set(PRODUCT_PAGE_VERSION_KEY.format(ct_model=ct_model, slug=slug), version, None)
+    return version
+
+
+def get_product_page_cache_key(ct_model, slug, categories):
+    # Счётчики категорий в меню входят в ключ, чтобы их изменение не требовало сброса всех страниц
+    categories_hash = hashlib.md5(repr(categories).encode()).hexdigest()
+    return PRODUCT_PAGE_CACHE_KEY.format(
+        ct_model=ct_model, slug=slug, version=get_product_page_version(ct_model, slug), categories=categories_hash
+    )
+
+
+CATALOG_MODIFIED_KEY = 'catalog_modified:{model_name}'
+
+
+def touch_catalog(model_name, modified=None):
+    modified = modified or timezone.now()
+    cache.set(CATALOG_MODIFIED_KEY.format(model_name=model_name), modified, settings.CATALOG_MODIFIED_TIMEOUT)
+    return modified
+
+
+def get_catalog_db_modified(model_name):
+    # Удаление товара отмечается в updated_at его категории, поэтому дата из базы учитывает и удаления
+    modified = [
+        apps.get_model('mainapp', model_name)._base_manager.aggregate(models.Max('updated_at'))['updated_at__max'],
+        apps.get_model('mainapp', 'Categories').objects.aggregate(models.Max('updated_at'))['updated_at__max']
+    ]
+    return max((value for value in modified if value), default=None) or timezone.now()
+
+
+def get_catalog_last_modified(model_name):
+    """
+    Отметка в кеше только ускоряет ответ, источник правды - updated_at в базе. Она живёт
+    CATALOG_MODIFIED_TIMEOUT секунд, так что изменения из других процессов (второй воркер, команды manage.py)
+    попадают в ETag и Last-Modified не позже, чем через это время, даже при кеше внутри процесса.
+    """
+    modified = cache.get(CATALOG_MODIFIED_KEY.format(model_name=model_name))
+    if modified is None:
+        modified = touch_catalog(model_name, get_catalog_db_modified(model_name))
+    return modified
@@ -1,49 +1,82 @@
+import os
+import uuid
+from decimal import Decimal, InvalidOperation
+
 from django.contrib import messages
 from django.shortcuts import render
 from django.views.generic import DetailView, View
-from django.http import HttpResponseRedirect
+from django.conf import settings
+from django.core.cache import cache
+from django.http import HttpResponse, HttpResponseForbidden, HttpResponseRedirect
 from django.contrib.contenttypes.models import ContentType
-from django.db import transaction
+from django.views.static import serve
 
 from .models import *
 from .mixins import *
 from .forms import *
-from .utils import calc_cart
+from .checkout import CheckoutError, place_order
+from .images import RENDITIONS_DIR
+from .profiling import render_metrics
+from .search import search_products
+from .utils import (
+    KeysetPaginator, get_first_page_query, get_page_query, get_product_ordering, get_product_page_cache_key
+)
 
 
-class BaseView(CartMixin, View):
+class BaseView(ConditionalPageMixin, CartMixin, View):
 
-    def get(self, request, *args, **kwargs):
-        categories = Categories.objects.get_categories_for_shop()
-        products = LatestProducts.objects.get_products_for_main_page('notebook', 'smartphone',
-                                                                     with_respect_to='smartphone')
+    def get_products(self):
+        return LatestProducts.objects.get_products_for_main_page('notebook', 'smartphone',
+                                                                 with_respect_to='smartphone')
+
+    def render_page(self, categories, products):
         context = {
             'categories': categories,
             'products': products,
             'cart': self.cart
         }
-        return render(request, 'mainapp/base.html', context)
+        return render(self.request, 'mainapp/base.html', context)
 
+    def get(self, request, *args, **kwargs):
+        return self.render_page(Categories.objects.get_categories_for_shop(), self.get_products())
 
-class ProductDetailView(CartMixin, CategoryDetailMixin, DetailView):
+
+class ProductDetailView(ConditionalPageMixin, CartMixin, CategoryDetailMixin, DetailView):
     CT_MODEL_MODEL_CLASS = {
         'notebook': Notebook,
         'smartphone': Smartphone
     }
 
-    def dispatch(self, request, *args, **kwargs):
+    def setup(self, request, *args, **kwargs):
+        super().setup(request, *args, **kwargs)
         self.model = self.CT_MODEL_MODEL_CLASS[kwargs['ct_model']]
         self.queryset = self.model._base_manager.all()
-        return super().dispatch(request, *args, **kwargs)
 
     context_object_name = 'product'
     template_name = 'mainapp/product_detail.html'
     slug_url_kwarg = 'slug'
+    CART_BADGE_PLACEHOLDER = '__cart_total_products__'
+
+    def get_page_content(self, categories):
+        # Страница кешируется целиком без учёта корзины, счётчик корзины подставляется при каждом запросе
+        cache_key = get_product_page_cache_key(self.kwargs['ct_model'], self.kwargs['slug'], categories)
+        content = cache.get(cache_key)
+        if content is None:
+            content = super().get(self.request, *self.args, **self.kwargs).render().content.decode()
+            cache.set(cache_key, content)
+        return content
+
+    def get_page_response(self, content, cart_total_products):
+        return HttpResponse(content.replace(self.CART_BADGE_PLACEHOLDER, str(cart_total_products), 1))
+
+    def get(self, request, *args, **kwargs):
+        content = self.get_page_content(Categories.objects.get_categories_for_shop())
+        return self.get_page_response(content, self.cart.total_products)
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
         context['ct_model'] = self.model._meta.model_name
-        context['cart'] = self.cart
+        context['cart'] = {'total_products': self.CART_BADGE_PLACEHOLDER}
         return context
 
 
@@ -53,21 +86,17 @@ class AddToCartView(CartMixin, View):
         ct_model, product_slug = kwargs.get('ct_model'), kwargs.get('slug')
         content_type = ContentType.objects.get(model=ct_model)
         product = content_type.model_class().objects.get(slug=product_slug)
-        cart_product, created = CartProducts.objects.get_or_create(
-            user=self.cart.owner,
-            cart=self.cart,
-            content_type=content_type,
-            object_id=product.id,
-            # final_price=product.price
-        )
-        if created:
-            self.cart.products.add(cart_product)
-        calc_cart(self.cart)
+        try:
+            self.cart.add_product(content_type, product)
+        except OutOfStockException as error:
+            # Страница товара кешируется целиком и сообщений не выводит, их показывает корзина
+            messages.add_message(request, messages.INFO, str(error))
+            return HttpResponseRedirect('/cart/')
         messages.add_message(request, messages.INFO, 'Товар успешно добавлен')
         return HttpResponseRedirect('/cart/')
 
 
-class CategoryDetailView(CartMixin, CategoryDetailMixin, DetailView):
+class CategoryDetailView(ConditionalPageMixin, CartMixin, CategoryDetailMixin, DetailView):
     model = Categories
     queryset = Categories.objects.all()
     context_object_name = 'category'
@@ -80,12 +109,63 @@ class CategoryDetailView(CartMixin, CategoryDetailMixin, DetailView):
         return context
 
 
+class CatalogView(CartMixin, View):
+
+    def get(self, request, *args, **kwargs):
+        sort, ordering = get_product_ordering(request.GET.get('sort'))
+        products = CatalogProduct.objects.all()
+        if request.GET.get('category'):
+            products = products.filter(category__slug=request.GET['category'])
+        if request.GET.get('q'):
+            products = products.filter(title__icontains=request.GET['q'])
+        try:
+            if request.GET.get('min_price'):
+                products = products.filter(price__gte=Decimal(request.GET['min_price']))
+            if request.GET.get('max_price'):
+                products = products.filter(price__lte=Decimal(request.GET['max_price']))
+        except InvalidOperation:
+            pass
+        page = KeysetPaginator(products, ordering).get_page(request.GET.get('cursor'))
+        context = {
+            'categories': Categories.objects.get_categories_for_shop(),
+            'products': page.object_list,
+            'page': page,
+            'sort': sort,
+            'first_page_query': get_first_page_query(request.GET),
+            'cart': self.cart
+        }
+        if page.has_next:
+            context['next_page_query'] = get_page_query(request.GET, page.next_cursor)
+        return render(request, 'mainapp/catalog.html', context)
+
+
+class SearchView(CartMixin, View):
+
+    def get(self, request, *args, **kwargs):
+        query = request.GET.get('q', '').strip()
+        try:
+            page = max(int(request.GET.get('page', 1)), 1)
+        except ValueError:
+            page = 1
+        products, has_next = search_products(query, page)
+        context = {
+            'categories': Categories.objects.get_categories_for_shop(),
+            'products': products,
+            'query': query,
+            'page': page,
+            'has_next': has_next,
+            'cart': self.cart
+        }
+        return render(request, 'mainapp/search.html', context)
+
+
 class CartView(CartMixin, View):
 
     def get(self, request, *args, **kwargs):
         categories = Categories.objects.get_categories_for_shop()
         context = {
             'cart': self.cart,
+            'cart_products': self.cart.get_products(),
             'categories': categories
         }
 
@@ -98,15 +178,7 @@ class DeleteFromCartView(CartMixin, View):
         ct_model, product_slug = kwargs.get('ct_model'), kwargs.get('slug')
         content_type = ContentType.objects.get(model=ct_model)
         product = content_type.model_class().objects.get(slug=product_slug)
-        cart_product = CartProducts.objects.get(
-            user=self.cart.owner,
-            cart=self.cart,
-            content_type=content_type,
-            object_id=product.id
-        )
-        self.cart.products.remove(cart_product)
-        cart_product.delete()
-        calc_cart(self.cart)
+        self.cart.remove_product(content_type, product)
         messages.add_message(request, messages.INFO, 'Товар успешно удалён')
         return HttpResponseRedirect('/cart/')
 
@@ -117,16 +189,12 @@ class ChangeQuantityView(CartMixin, View):
         ct_model, product_slug = kwargs.get('ct_model'), kwargs.get('slug')
         content_type = ContentType.objects.get(model=ct_model)
         product = content_type.model_class().objects.get(slug=product_slug)
-        cart_product = CartProducts.objects.get(
-            user=self.cart.owner,
-            cart=self.cart,
-            content_type=content_type,
-            object_id=product.id
-        )
         quantity = int(request.POST.get('quantity'))
-        cart_product.quantity = quantity
-        cart_product.save()
-        calc_cart(self.cart)
+        try:
+            self.cart.change_quantity(content_type, product, quantity)
+        except OutOfStockException as error:
+            messages.add_message(request, messages.INFO, str(error))
+            return HttpResponseRedirect('/cart/')
         messages.add_message(request, messages.INFO, 'Количество товара успешно изменено')
         return HttpResponseRedirect('/cart/')
 
@@ -134,9 +202,10 @@ class ChangeQuantityView(CartMixin, View):
 class CheckoutView(CartMixin, View):
     def get(self, request, *args, **kwargs):
         categories = Categories.objects.get_categories_for_shop()
-        form = OrderForm(request.POST or None)
+        form = OrderForm(initial={'idempotency_key': uuid.uuid4()})
         context = {
             'cart': self.cart,
+            'cart_products': self.cart.get_products(),
             'categories': categories,
             'form': form
         }
@@ -146,26 +215,40 @@ class CheckoutView(CartMixin, View):
 
 class MakeOrderView(CartMixin, View):
 
-    @transaction.atomic
     def post(self, request, *args, **kwargs):
+        if not request.user.is_authenticated:
+            messages.add_message(request, messages.INFO, 'Войдите, чтобы оформить заказ')
+            return HttpResponseRedirect('/checkout/')
         form = OrderForm(request.POST or None)
-        customer = Customers.objects.get(user=request.user)
         if form.is_valid():
-            new_order = form.save(commit=False)
-            new_order.customer = customer
-            new_order.first_name = form.cleaned_data['first_name']
-            new_order.last_name = form.cleaned_data['last_name']
-            new_order.phone = form.cleaned_data['phone']
-            new_order.address = form.cleaned_data['address']
-            new_order.buying_type = form.cleaned_data['buying_type']
-            new_order.order_at = form.cleaned_data['order_at']
-            new_order.comment = form.cleaned_data['comment']
-            new_order.save()
-            self.cart.in_order = True
-            self.cart.save()
-            new_order.cart = self.cart
-            new_order.save()
-            customer.orders.add(new_order)
+            try:
+                place_order(self.cart.owner, self.cart, form.save(commit=False), form.cleaned_data['idempotency_key'])
+            except CheckoutError as error:
+                messages.add_message(request, messages.INFO, str(error))
+                return HttpResponseRedirect('/cart/')
             messages.add_message(request, messages.INFO, 'Спасибоа за заказ!')
             return HttpResponseRedirect('/')
         return HttpResponseRedirect('/checkout/')
+
+
+class RenditionView(View):
+    # Копии адресуются хешем содержимого и никогда не меняются, поэтому их можно кешировать навсегда.
+    # Подключается только при DEBUG, в продакшене тот же заголовок ставит веб-сервер
+    CACHE_CONTROL = 'public, max-age=31536000, immutable'
+
+    def get(self, request, path, *args, **kwargs):
+        response = serve(request, path, document_root=os.path.join(settings.MEDIA_ROOT, RENDITIONS_DIR))
+        response['Cache-Control'] = self.CACHE_CONTROL
+        return response
+
+
+class MetricsView(View):
+    # Статистика профилирования для Prometheus; наружу не отдаётся, её забирают с того же хоста
+    LOCAL_ADDRESSES = ('127.0.0.1', '::1')
+    CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+    def get(self, request, *args, **kwargs):
+        # За обратным прокси все запросы приходят с localhost, такие отличаем по X-Forwarded-For
+        if request.META.get('REMOTE_ADDR') not in self.LOCAL_ADDRESSES or 'HTTP_X_FORWARDED_FOR' in request.META:
+            return HttpResponseForbidden()
+        return HttpResponse(render_metrics(), content_type=self.CONTENT_TYPE)